@@ -0,0 +1,124 @@
+# Shared audio capture
+## One input stream feeds a ring buffer; recognition windows are views into that buffer
+
+import atexit
+import heapq
+import itertools
+import threading
+from datetime import datetime, timedelta
+from multiprocessing import shared_memory
+import numpy as np
+import pyaudio
+from dejavu.base_classes.base_recognizer import BaseRecognizer
+
+class AudioCapture(threading.Thread):
+
+    # Same input format as Dejavu MicrophoneRecognizer
+    FORMAT = pyaudio.paInt16
+    CHANNELS = 2
+    SAMPLE_RATE = 44100
+    CHUNK_SIZE = 1024         # (frames) - smaller than Dejavu's 8192 to keep window starts precise
+
+    def __init__(self, capacity, shared=False):
+        threading.Thread.__init__(self, name='Capture', daemon=True)
+
+        # Buffer is mirrored: every frame is stored twice, "capacity" apart. This way any window not longer
+        # than the capacity is a contiguous slice, and can be handed over as a view without copying
+        self.capacity = int(capacity * self.SAMPLE_RATE)
+        self.channels = self.CHANNELS
+        shape = (self.channels, 2 * self.capacity)
+        if shared:
+            # Visible to forked worker processes
+            self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.int16).itemsize)
+            self.buffer = np.ndarray(shape, dtype=np.int16, buffer=self.shm.buf)
+            self.buffer.fill(0)
+            atexit.register(self.close)
+        else:
+            self.shm = None
+            self.buffer = np.zeros(shape, dtype=np.int16)
+        self.frames = 0           # total number of frames captured so far
+        self.frames_lock = threading.Lock()
+        self.frames_time = datetime.now()    # wall-clock time at which self.frames was reached
+
+        # Threads waiting for their window, as a heap of (frames needed, tie breaker, event). Each thread is woken
+        # only once, when its window is complete, rather than on every chunk
+        self.waiters = []
+        self.waiter_ids = itertools.count()
+
+    def run(self):
+        stream = pyaudio.PyAudio().open(format=self.FORMAT, channels=self.channels, rate=self.SAMPLE_RATE, input=True, frames_per_buffer=self.CHUNK_SIZE)
+        while True:
+            data = stream.read(self.CHUNK_SIZE, exception_on_overflow=False)
+            self.write(np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels).T)
+
+    # Append samples (shape: channels x frames)
+    def write(self, data):
+        n = data.shape[1]
+        pos = self.frames % self.capacity
+        head = min(n, self.capacity - pos)
+        self.buffer[:, pos:pos + head] = data[:, :head]
+        self.buffer[:, self.capacity + pos:self.capacity + pos + head] = data[:, :head]
+        if head < n:
+            self.buffer[:, :n - head] = data[:, head:]
+            self.buffer[:, self.capacity:self.capacity + n - head] = data[:, head:]
+        with self.frames_lock:
+            self.frames += n
+            self.frames_time = datetime.now()
+            while len(self.waiters) and self.waiters[0][0] <= self.frames:
+                heapq.heappop(self.waiters)[2].set()
+
+    def close(self):
+        if self.shm is not None:
+            self.buffer = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def position(self):
+        return self.frames
+
+    # Wall-clock time at which a frame was (or will be) captured
+    def getTime(self, frame):
+        with self.frames_lock:
+            return self.frames_time - timedelta(seconds=(self.frames - frame) / self.SAMPLE_RATE)
+
+    # Block until the window [start, start + length) is captured, then return it as a view (one row per channel)
+    def getWindow(self, start, length):
+        return self.getView(start, length) if self.waitWindow(start, length) else None
+
+    # Block until the window [start, start + length) is captured; False if it is already lost
+    def waitWindow(self, start, length):
+        event = None
+        with self.frames_lock:
+            if self.frames < start + length:
+                event = threading.Event()
+                heapq.heappush(self.waiters, (start + length, next(self.waiter_ids), event))
+        if event is not None:
+            event.wait()
+        return not self.isOverrun(start)
+
+    # View of a window, without any checks
+    def getView(self, start, length):
+        pos = start % self.capacity
+        return self.buffer[:, pos:pos + length]
+
+    # RMS level of samples (dBFS); -inf for digital silence
+    @staticmethod
+    def getLevel(samples):
+        power = np.square(samples, dtype=np.float32).mean()
+        return 10 * np.log10(power / 32768 ** 2) if power > 0 else -np.inf
+
+    # Window data starting at "start" has been (partially) overwritten by newer input
+    def isOverrun(self, start):
+        return self.frames - start > self.capacity
+
+
+# Dejavu recognizer over a captured window
+class BufferRecognizer(BaseRecognizer):
+
+    def __init__(self, dejavu):
+        super().__init__(dejavu)
+        self.Fs = AudioCapture.SAMPLE_RATE
+
+    def recognize(self, window):
+        return self._recognize(*window)
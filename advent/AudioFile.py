@@ -0,0 +1,50 @@
+# Recorded audio input
+## Reads a recording in chunks, laid out the same way as AudioCapture stores live input (channels x frames, 16 bit)
+
+import os
+import wave
+import numpy as np
+
+CHUNK_DURATION = 1        # (s)
+
+def readAudioChunks(fname, channels, sample_rate):
+    chunk_size = int(CHUNK_DURATION * sample_rate)
+    ext = os.path.splitext(fname)[1].lower()
+
+    if ext == '.wav':
+        with wave.open(fname, 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f'{fname}: only 16 bit WAV files are supported')
+            if wav.getframerate() != sample_rate:
+                raise ValueError(f'{fname}: sampling frequency {wav.getframerate()} Hz is not supported; convert to {sample_rate} Hz first')
+            data = wav.readframes(chunk_size)
+            while len(data):
+                yield fitChannels(np.frombuffer(data, dtype='<i2').reshape(-1, wav.getnchannels()).T, channels)
+                data = wav.readframes(chunk_size)
+
+    elif ext in ('.raw', '.pcm'):
+        # Same format as live capture: signed 16 bit little endian, interleaved, e.g., from "parec --format=s16le --rate=44100 --channels=2"
+        with open(fname, 'rb') as raw:
+            data = raw.read(chunk_size * channels * 2)
+            while len(data) >= channels * 2:
+                data = data[:len(data) - len(data) % (channels * 2)]
+                yield np.frombuffer(data, dtype='<i2').reshape(-1, channels).T
+                data = raw.read(chunk_size * channels * 2)
+
+    else:
+        # Anything else (FLAC, MP3, ...) is decoded by Dejavu with ffmpeg. The entire file is decoded at once
+        from dejavu.logic.decoder import read
+        data, fs, file_hash = read(fname)
+        if fs != sample_rate:
+            raise ValueError(f'{fname}: sampling frequency {fs} Hz is not supported; convert to {sample_rate} Hz first')
+        data = fitChannels(np.array(data, dtype=np.int16), channels)
+        for pos in range(0, data.shape[1], chunk_size):
+            yield data[:, pos:pos + chunk_size]
+
+# Mono recordings are duplicated into all channels; extra channels are dropped
+def fitChannels(data, channels):
+    if data.shape[0] == channels:
+        return data
+    if data.shape[0] == 1:
+        return np.repeat(data, channels, axis=0)
+    return data[:channels]
@@ -0,0 +1,128 @@
+# In-memory fingerprint index
+## Array-backed replacement for Dejavu database lookups during recognition. Jingle database is small and does not change
+## while AdVent runs, so it is loaded once at startup and matched without any database traffic afterwards
+
+import logging
+import numpy as np
+from dejavu.config.settings import SONG_NAME, FIELD_FILE_SHA1, FIELD_TOTAL_HASHES, FINGERPRINT_REDUCTION
+
+LOGGER = logging.getLogger('advent')
+
+class HashIndex:
+
+    HASH_SIZE = FINGERPRINT_REDUCTION // 2    # (B) - hashes are stored in binary form in the database
+    FETCH_SIZE = 100000                       # rows fetched from the database at once
+    AD_START = 0b0001                         # jingle flag: ad break starts
+    AD_END = 0b0010                           # jingle flag: ad break ends
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=f'S{self.HASH_SIZE}')    # sorted
+        self.song_ids = np.empty(0, dtype=np.int32)               # parallel to hashes
+        self.offsets = np.empty(0, dtype=np.int32)                # parallel to hashes
+        self.songs = {}
+        self.partitions = {}                                      # subsets of the index by channel and flags, built on first use
+
+    # Jingle names start with COUNTRY_CHANNEL
+    @staticmethod
+    def getChannel(song_name):
+        return '_'.join(song_name.split('_')[:2])
+
+    # Jingle names end with FLAGS; tracks not following the naming convention have none
+    @staticmethod
+    def getFlags(song_name):
+        try:
+            return int(song_name.split('_')[4])
+        except (IndexError, ValueError):
+            return 0
+
+    # Load fingerprinted tracks from Dejavu database. Hashes of other size than expected (see db-djv-pg health check D0040)
+    ## would shift all the following ones in the array; they are left out
+    def load(self, db):
+        hashes = bytearray()
+        song_ids = []
+        offsets = []
+        skipped = 0
+        with db.cursor() as cur:
+            cur.execute("SELECT song_id, song_name, file_sha1, total_hashes FROM songs WHERE fingerprinted = 1")
+            for song_id, song_name, file_sha1, total_hashes in cur.fetchall():
+                self.songs[song_id] = {SONG_NAME: song_name, FIELD_FILE_SHA1: bytes(file_sha1).hex().upper(), FIELD_TOTAL_HASHES: total_hashes}
+
+            cur.execute("SELECT hash, song_id, \"offset\" FROM fingerprints")
+            rows = cur.fetchmany(self.FETCH_SIZE)
+            while rows:
+                for hsh, song_id, offset in rows:
+                    if song_id in self.songs:
+                        if len(hsh) != self.HASH_SIZE:
+                            skipped += 1
+                            continue
+                        hashes += bytes(hsh)
+                        song_ids.append(song_id)
+                        offsets.append(offset)
+                rows = cur.fetchmany(self.FETCH_SIZE)
+        if skipped:
+            LOGGER.warning(f'Warning: {skipped} fingerprints having hash size other than {self.HASH_SIZE} B ignored')
+
+        self.setArrays(np.frombuffer(bytes(hashes), dtype=self.hashes.dtype), np.array(song_ids, dtype=np.int32), np.array(offsets, dtype=np.int32))
+
+    def setArrays(self, hashes, song_ids, offsets):
+        order = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[order]
+        self.song_ids = song_ids[order]
+        self.offsets = offsets[order]
+        self.partitions = {}
+
+    # Index restricted to jingles of one channel and/or having any of the flags given. Masking keeps the hashes sorted
+    def getPartition(self, channel=None, flags=None):
+        if channel is None and flags is None:
+            return self
+        partition = self.partitions.get((channel, flags))
+        if partition is None:
+            partition = HashIndex()
+            partition.songs = {song_id: song for song_id, song in self.songs.items()
+                if (channel is None or self.getChannel(song[SONG_NAME]) == channel) and (flags is None or self.getFlags(song[SONG_NAME]) & flags)}
+            mask = np.isin(self.song_ids, list(partition.songs.keys()))
+            partition.hashes = self.hashes[mask]
+            partition.song_ids = self.song_ids[mask]
+            partition.offsets = self.offsets[mask]
+            self.partitions[(channel, flags)] = partition
+        return partition
+
+    # Build partitions for ad start and ad end jingles, overall and optionally per channel, at once (e.g., before forking workers)
+    def buildPartitions(self, by_channel=False):
+        channels = [None]
+        if by_channel:
+            channels += list(set([self.getChannel(song[SONG_NAME]) for song in self.songs.values()]))
+        for channel in channels:
+            for flags in (self.AD_START, self.AD_END):
+                self.getPartition(channel, flags)
+
+    def getNumFingerprints(self):
+        return len(self.hashes)
+
+    def getNumSongs(self):
+        return len(self.songs)
+
+    # Same contract as Dejavu database return_matches(): list of (song_id, offset difference) and matched hash count per song
+    def return_matches(self, hashes, batch_size=None):
+        mapper = {}
+        for hsh, offset in hashes:
+            mapper.setdefault(hsh.upper(), []).append(offset)
+        values = list(mapper.keys())
+
+        query = np.array([bytes.fromhex(hsh) for hsh in values], dtype=self.hashes.dtype)
+        lo = np.searchsorted(self.hashes, query, side='left')
+        hi = np.searchsorted(self.hashes, query, side='right')
+
+        results = []
+        dedup_hashes = {}
+        for i in np.flatnonzero(hi > lo):
+            sampled_offsets = mapper[values[i]]
+            for song_id, offset in zip(self.song_ids[lo[i]:hi[i]].tolist(), self.offsets[lo[i]:hi[i]].tolist()):
+                dedup_hashes[song_id] = dedup_hashes.get(song_id, 0) + 1
+                for sampled_offset in sampled_offsets:
+                    results.append((song_id, offset - sampled_offset))
+        return results, dedup_hashes
+
+    # Same contract as Dejavu database get_song_by_id()
+    def get_song_by_id(self, song_id):
+        return self.songs.get(song_id)
@@ -0,0 +1,89 @@
+# Runtime metrics
+## Counters and histograms of the recognition pipeline and TV control, exposed in Prometheus text format over HTTP
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Metrics:
+
+    # name: (help, bucket upper bounds)
+    HISTOGRAMS = {
+        'advent_stage_seconds': ('Duration of recognition stages', [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]),
+        'advent_confidence': ('Confidence of the best match', [0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 0.75, 1]),
+        'advent_scheduler_lag_seconds': ('Delay between the end of a window and the start of its recognition', [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5]),
+        'advent_tv_action_seconds': ('Duration of TV commands', [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]),
+    }
+
+    # name: help
+    COUNTERS = {
+        'advent_windows_total': 'Recognition windows (or streaming portions) processed',
+        'advent_skipped_windows_total': 'Windows not recognized for being too quiet',
+        'advent_lost_windows_total': 'Windows lost to audio capture overrun',
+        'advent_tv_action_failures_total': 'TV commands failed',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {name: {} for name in self.COUNTERS}        # name: {labels: value}
+        self.histograms = {name: {} for name in self.HISTOGRAMS}    # name: {labels: [bucket counts, sum, count]}
+
+    @staticmethod
+    def getLabels(labels):
+        return ','.join([f'{key}="{value}"' for key, value in sorted(labels.items())])
+
+    def inc(self, name, value = 1, **labels):
+        key = self.getLabels(labels)
+        with self.lock:
+            self.counters[name][key] = self.counters[name].get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self.getLabels(labels)
+        buckets = self.HISTOGRAMS[name][1]
+        with self.lock:
+            hist = self.histograms[name].setdefault(key, [[0] * len(buckets), 0, 0])
+            for n, bound in enumerate(buckets):
+                if value <= bound:
+                    hist[0][n] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, help in self.COUNTERS.items():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+                for key, value in (self.counters[name] or {'': 0}).items():
+                    lines.append(f'{name}{{{key}}} {value}' if key else f'{name} {value}')
+            for name, (help, buckets) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+                for key, (counts, total, count) in self.histograms[name].items():
+                    sep = ',' if key else ''
+                    for bound, bucket_count in zip(buckets, counts):
+                        lines.append(f'{name}_bucket{{{key}{sep}le="{bound}"}} {bucket_count}')
+                    lines.append(f'{name}_bucket{{{key}{sep}le="+Inf"}} {count}')
+                    lines.append(f'{name}_sum{{{key}}} {total}' if key else f'{name}_sum {total}')
+                    lines.append(f'{name}_count{{{key}}} {count}' if key else f'{name}_count {count}')
+        return '\n'.join(lines) + '\n'
+
+    # Serve metrics from a background thread
+    def serve(self, port, address = '127.0.0.1'):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass    # scraping every few seconds would flood the console
+
+        server = ThreadingHTTPServer((address, port), Handler)
+        threading.Thread(target=server.serve_forever, name='Metrics', daemon=True).start()
@@ -0,0 +1,43 @@
+# Process pool recognition backend
+## Fingerprinting and matching are CPU-bound and serialize on the GIL when run from threads, so here they run in worker
+## processes. Audio is not pickled: workers read recognition windows directly from the capture buffer in shared memory
+
+import multiprocessing
+from dejavu import Dejavu
+from advent.AudioCapture import BufferRecognizer
+
+# Worker process state
+WORKER_CAPTURE = None
+WORKER_DJV = None
+WORKER_INDEX = None
+
+def initWorker(capture, djv_config, hash_index):
+    global WORKER_CAPTURE
+    global WORKER_DJV
+    global WORKER_INDEX
+
+    WORKER_CAPTURE = capture    # inherited through fork; only the shared buffer is used
+    WORKER_DJV = Dejavu(djv_config)
+    WORKER_INDEX = hash_index
+    if hash_index is not None:
+        WORKER_DJV.db = hash_index
+
+# Partition (channel, flags) restricts matching to a part of the in-memory index
+def recognizeWindow(start, length, partition=(None, None)):
+    if WORKER_INDEX is not None:
+        WORKER_DJV.db = WORKER_INDEX.getPartition(*partition)
+    return WORKER_DJV.recognize(BufferRecognizer, WORKER_CAPTURE.getView(start, length))    # matches and stage times
+
+
+class RecognizerPool:
+
+    # Must be created before any thread is started. "fork" lets workers inherit the capture buffer and the fingerprint index as is
+    def __init__(self, processes, capture, djv_config, hash_index=None):
+        self.pool = multiprocessing.get_context('fork').Pool(processes, initializer=initWorker, initargs=(capture, djv_config, hash_index))
+
+    # Blocks the calling thread (but not the others) until the window is recognized
+    def recognize(self, start, length, partition=(None, None)):
+        return self.pool.apply(recognizeWindow, (start, length, partition))
+
+    def recognizeAsync(self, start, length, partition=(None, None)):
+        return self.pool.apply_async(recognizeWindow, (start, length, partition))
@@ -0,0 +1,153 @@
+# Embedded Dejavu database
+## Tracks and fingerprints with the same tables as Dejavu PostgreSQL database, kept in a single SQLite file: there is no
+## database server to run, and lookups do not leave the process. Registered into Dejavu as database type "sqlite", with
+## config {"database_type": "sqlite", "database": {"database": FILE}}
+
+import sqlite3
+from contextlib import contextmanager
+from dejavu.config import settings
+from dejavu.config.settings import SONG_ID, SONG_NAME, FIELD_FILE_SHA1, FIELD_TOTAL_HASHES
+
+class SQLiteDatabase:
+
+    type = 'sqlite'
+    TIMEOUT = 30                       # (s) - wait for a concurrent writer to finish
+    MMAP_SIZE = 256 * 1024 * 1024      # (B) - file size read through memory mapping
+    MAX_VARIABLES = 999                # query parameters supported by any SQLite version
+
+    # Hash index holds track and offset as well, so that lookups are answered from the index alone
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS songs (song_id INTEGER PRIMARY KEY AUTOINCREMENT, song_name TEXT NOT NULL, fingerprinted INTEGER DEFAULT 0, "
+            "file_sha1 BLOB, total_hashes INTEGER NOT NULL DEFAULT 0, date_created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "date_modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+        "CREATE TABLE IF NOT EXISTS fingerprints (hash BLOB NOT NULL, song_id INTEGER NOT NULL REFERENCES songs (song_id) ON DELETE CASCADE, "
+            "\"offset\" INTEGER NOT NULL, date_created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, "
+            "date_modified TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, UNIQUE (song_id, \"offset\", hash))",
+        "CREATE INDEX IF NOT EXISTS ix_fingerprints_hash ON fingerprints (hash, song_id, \"offset\")",
+    ]
+
+    def __init__(self, database, **options):
+        self.database = database
+        self.conn = None
+        self.connect()
+
+    # Make Dejavu aware of this database type
+    @staticmethod
+    def register():
+        settings.DATABASES[SQLiteDatabase.type] = (SQLiteDatabase.__module__, SQLiteDatabase.__name__)
+
+    def connect(self):
+        self.conn = sqlite3.connect(self.database, timeout=self.TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute(f"PRAGMA mmap_size = {self.MMAP_SIZE}")
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    # Commits on success, as Dejavu database cursors do
+    @contextmanager
+    def cursor(self):
+        cur = self.conn.cursor()
+        try:
+            yield cur
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    # Readers do not block the writer and vice versa (e.g., AdVent running during an import)
+    def createTables(self):
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        with self.cursor() as cur:
+            for query in self.SCHEMA:
+                cur.execute(query)
+
+    def setup(self):
+        self.createTables()
+        self.delete_unfingerprinted_songs()
+
+    def empty(self):
+        with self.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS fingerprints")
+            cur.execute("DROP TABLE IF EXISTS songs")
+        self.setup()
+
+    def before_fork(self):
+        self.close()
+
+    def after_fork(self):
+        self.connect()
+
+    def delete_unfingerprinted_songs(self):
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM songs WHERE fingerprinted = 0")
+
+    def get_num_songs(self):
+        with self.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM songs WHERE fingerprinted = 1")
+            return cur.fetchone()[0]
+
+    def get_num_fingerprints(self):
+        with self.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM fingerprints")
+            return cur.fetchone()[0]
+
+    def set_song_fingerprinted(self, song_id):
+        with self.cursor() as cur:
+            cur.execute("UPDATE songs SET fingerprinted = 1, date_modified = CURRENT_TIMESTAMP WHERE song_id = ?", (song_id,))
+
+    def get_songs(self):
+        with self.cursor() as cur:
+            cur.execute("SELECT song_id, song_name, upper(hex(file_sha1)), total_hashes, date_created FROM songs WHERE fingerprinted = 1")
+            return [{SONG_ID: song_id, SONG_NAME: song_name, FIELD_FILE_SHA1: file_sha1, FIELD_TOTAL_HASHES: total_hashes, 'date_created': date_created}
+                for song_id, song_name, file_sha1, total_hashes, date_created in cur.fetchall()]
+
+    def get_song_by_id(self, song_id):
+        with self.cursor() as cur:
+            cur.execute("SELECT song_name, upper(hex(file_sha1)), total_hashes FROM songs WHERE song_id = ?", (song_id,))
+            song = cur.fetchone()
+        if song is None:
+            return None
+        return {SONG_NAME: song[0], FIELD_FILE_SHA1: song[1], FIELD_TOTAL_HASHES: song[2]}
+
+    def insert_song(self, song_name, file_hash, total_hashes):
+        with self.cursor() as cur:
+            cur.execute("INSERT INTO songs (song_name, file_sha1, total_hashes) VALUES (?, ?, ?)", (song_name, bytes.fromhex(file_hash), total_hashes))
+            return cur.lastrowid
+
+    def insert_hashes(self, song_id, hashes, batch_size=1000):
+        with self.cursor() as cur:
+            cur.executemany("INSERT OR IGNORE INTO fingerprints (song_id, hash, \"offset\") VALUES (?, ?, ?)",
+                [(song_id, bytes.fromhex(hsh), int(offset)) for hsh, offset in hashes])
+
+    def delete_songs_by_id(self, song_ids, batch_size=1000):
+        song_ids = list(song_ids)
+        with self.cursor() as cur:
+            for index in range(0, len(song_ids), self.MAX_VARIABLES):
+                batch = song_ids[index:index + self.MAX_VARIABLES]
+                cur.execute(f"DELETE FROM songs WHERE song_id IN ({', '.join(['?'] * len(batch))})", batch)
+
+    # Same contract as Dejavu database return_matches(): list of (song_id, offset difference) and matched hash count per song
+    def return_matches(self, hashes, batch_size=1000):
+        mapper = {}
+        for hsh, offset in hashes:
+            mapper.setdefault(hsh.upper(), []).append(offset)
+        values = list(mapper.keys())
+        batch_size = min(batch_size, self.MAX_VARIABLES)
+
+        results = []
+        dedup_hashes = {}
+        with self.cursor() as cur:
+            for index in range(0, len(values), batch_size):
+                batch = values[index:index + batch_size]
+                cur.execute(f"SELECT upper(hex(hash)), song_id, \"offset\" FROM fingerprints WHERE hash IN ({', '.join(['?'] * len(batch))})",
+                    [bytes.fromhex(hsh) for hsh in batch])
+                for hsh, song_id, offset in cur:
+                    dedup_hashes[song_id] = dedup_hashes.get(song_id, 0) + 1
+                    for sampled_offset in mapper[hsh]:
+                        results.append((song_id, offset - sampled_offset))
+        return results, dedup_hashes
@@ -0,0 +1,71 @@
+# Incremental fingerprinting
+## Produces the same hashes as Dejavu fingerprint() over a continuous stream, but every sample is transformed, peak-picked
+## and hashed only once, as the audio arrives
+
+import hashlib
+from collections import deque
+from itertools import islice
+from operator import itemgetter
+import numpy as np
+import matplotlib.mlab as mlab
+from dejavu.logic.fingerprint import get_2D_peaks
+from dejavu.config.settings import DEFAULT_FS, DEFAULT_WINDOW_SIZE, DEFAULT_OVERLAP_RATIO, DEFAULT_FAN_VALUE, DEFAULT_AMP_MIN, \
+    PEAK_NEIGHBORHOOD_SIZE, MIN_HASH_TIME_DELTA, MAX_HASH_TIME_DELTA, FINGERPRINT_REDUCTION
+
+class StreamFingerprinter:
+
+    WINDOW_SIZE = DEFAULT_WINDOW_SIZE
+    HOP = DEFAULT_WINDOW_SIZE - int(DEFAULT_WINDOW_SIZE * DEFAULT_OVERLAP_RATIO)   # (samples) - distance between spectrogram columns
+
+    def __init__(self, Fs=DEFAULT_FS):
+        self.Fs = Fs
+        self.spectrum = None      # recent spectrogram columns, still needed as neighborhood for peak search
+        self.spectrum_start = 0   # column number of the first column kept in self.spectrum
+        self.peaks_done = 0       # peaks are final for all columns before this one
+        self.peaks = deque()      # final peaks (frequency, column) not hashed yet
+
+    # Number of samples needed to produce n new spectrogram columns. Consecutive portions of the stream shall overlap
+    # by WINDOW_SIZE - HOP samples, i.e., the next portion starts n * HOP samples after the current one
+    @classmethod
+    def getPortionLength(cls, n):
+        return (n - 1) * cls.HOP + cls.WINDOW_SIZE
+
+    # Fingerprint next portion of the stream; returns hashes which became final, with offsets counted from the stream start
+    def process(self, samples):
+        columns = mlab.specgram(samples, NFFT=self.WINDOW_SIZE, Fs=self.Fs, window=mlab.window_hanning, noverlap=self.WINDOW_SIZE - self.HOP)[0]
+        columns = 10 * np.log10(columns, out=np.zeros_like(columns), where=(columns != 0))
+        self.spectrum = columns if self.spectrum is None else np.hstack((self.spectrum, columns))
+
+        # Peaks closer to the end than neighborhood size depend on columns not seen yet
+        horizon = self.spectrum_start + self.spectrum.shape[1] - PEAK_NEIGHBORHOOD_SIZE
+        if horizon > self.peaks_done:
+            peaks = []
+            for freq, column in get_2D_peaks(self.spectrum, plot=False, amp_min=DEFAULT_AMP_MIN):
+                column += self.spectrum_start
+                if self.peaks_done <= column < horizon:
+                    peaks.append((freq, int(column)))
+            peaks.sort(key=itemgetter(1))
+            self.peaks.extend(peaks)
+            self.peaks_done = horizon
+
+            drop = self.peaks_done - PEAK_NEIGHBORHOOD_SIZE - self.spectrum_start
+            if drop > 0:
+                self.spectrum = self.spectrum[:, drop:]
+                self.spectrum_start += drop
+
+        return self.generateHashes()
+
+    # Same pairing as Dejavu generate_hashes(); a peak is hashed once all its fan-out peaks are known
+    def generateHashes(self):
+        hashes = []
+        while self.peaks:
+            freq1, t1 = self.peaks[0]
+            if len(self.peaks) < DEFAULT_FAN_VALUE and self.peaks_done - t1 <= MAX_HASH_TIME_DELTA:
+                break
+            for freq2, t2 in islice(self.peaks, 1, DEFAULT_FAN_VALUE):
+                t_delta = t2 - t1
+                if MIN_HASH_TIME_DELTA <= t_delta <= MAX_HASH_TIME_DELTA:
+                    h = hashlib.sha1(f"{str(freq1)}|{str(freq2)}|{str(t_delta)}".encode('utf-8'))
+                    hashes.append((h.hexdigest()[0:FINGERPRINT_REDUCTION], t1))
+            self.peaks.popleft()
+        return hashes
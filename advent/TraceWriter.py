@@ -0,0 +1,36 @@
+# Recognition trace
+## One JSON object per line and per event (e.g., pandas.read_json(fname, lines=True)). Records are queued and written by
+## a background thread, so recognition never waits for the disk
+
+import atexit
+import json
+import queue
+import threading
+
+class TraceWriter(threading.Thread):
+
+    def __init__(self, fname):
+        threading.Thread.__init__(self, name='Trace', daemon=True)
+        self.file = open(fname, 'a')
+        self.records = queue.SimpleQueue()
+
+    def start(self):
+        super().start()
+        atexit.register(self.close)    # write what is still queued
+
+    def run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            if self.records.empty():
+                self.file.flush()
+        self.file.close()
+
+    def write(self, record):
+        self.records.put(record)
+
+    def close(self):
+        self.records.put(None)
+        self.join()
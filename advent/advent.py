@@ -7,33 +7,52 @@ import threading
 import time
 import argparse
 import logging
+import wave
+import math
+from collections import deque
 from pkg_resources import Requirement, resource_filename
 from datetime import datetime
 from datetime import timedelta
 from dejavu import Dejavu
-from dejavu.logic.recognizer.microphone_recognizer import MicrophoneRecognizer
 from advent import __version__
+from advent.AudioCapture import AudioCapture, BufferRecognizer
+from advent.AudioFile import readAudioChunks
+from advent.HashIndex import HashIndex
+from advent.SQLiteDatabase import SQLiteDatabase
+from advent.StreamFingerprinter import StreamFingerprinter
+from advent.RecognizerPool import RecognizerPool
+from advent.Metrics import Metrics
+from advent.TraceWriter import TraceWriter
 from tv_control.TVControl import TVControl
 from tv_control.TVControlPulseAudio import TVControlPulseAudio
 from tv_control.TVControlHarmonyHub import TVControlHarmonyHub
+from tv_control.TVActuator import TVActuator
 
 # Settings
 VERSION=__version__
 NUM_THREADS = 2           #     - number of threads to run
 REC_INTERVAL = 2          # (s) - Dejavu listening interval
-REC_DEADBAND = 0.25       # (s) - Dejavu processing time for an interval of 2 s with 2 threads. Measured experimentally on 4 x 1200 MHz machine with 84 jingles in DB
+REC_DEADBAND = 0.25       # (s) - Dejavu processing time for an interval of 2 s with 2 threads. Measured experimentally on 4 x 1200 MHz machine with 84 jingles in DB. Initial estimate only; actual deadband is measured at runtime
+DEADBAND_SMOOTHING = 0.1  #     - weight of the latest deadband measurement in the running average
 REC_CONFIDENCE = 10       # (%) - lowest still OK without false positives
+REC_HOP = 0.5             # (s) - matching period in streaming mode
+REC_GATE = -60            # (dBFS) - input quieter than this is not worth recognizing
 TV_DEAD_TIME = 30         # (s) - action dead time after previous action taken on TV
 MUTE_TIMEOUT = 600        # (s) - if TV is muted, unmute automatically after this time. Must be >= TV_DEAD_TIME
+CHANNEL_PROBE = 0         #     - with channel affinity, match every N-th window against the full database (0 = no affinity)
+REC_BUFFER = 10           # (s) - audio kept in capture buffer on top of recognition interval. Must cover the slowest recognition
 LOG_FILE = 'advent.log'
+TRACE_MATCHES = 3         #     - number of best matches per window kept in the trace
 
 # Globals
 DJV_CONFIG = None
+HASH_INDEX = None
 REC_OFFSET = (REC_INTERVAL + REC_DEADBAND) / NUM_THREADS
-REC_OFFSET_TD = timedelta(seconds=REC_OFFSET)
 TV_DEAD_TIME_TD = timedelta(seconds=TV_DEAD_TIME)
 MUTE_TIMEOUT_TD = timedelta(seconds=MUTE_TIMEOUT)
 LOGGER = logging.getLogger('advent')
+METRICS = Metrics()
+TRACE = None
 
 # Generic TV
 class TV:
@@ -44,10 +63,13 @@ class TV:
         self.tvc = tvc
         self.setAction(action)
         self.volume = volume
-        self.detection_lock = threading.Lock()
+        self.clock = datetime.now    # replay runs on audio time instead
         self.action_lock = threading.Lock()
-        self.last_detection_time = datetime.now()
-        self.last_action_time = datetime.now() - timedelta(seconds=TV_DEAD_TIME)
+        self.last_action_time = self.clock() - timedelta(seconds=TV_DEAD_TIME)
+        self.channel = None             # COUNTRY_CHANNEL of the last hit
+        self.channel_lock = threading.Lock()
+        self.channel_windows = 0        # windows restricted to the channel since last full probe
+        self.tvc.on_change = self.syncAction
 
     def getAction(self):
         return self.action
@@ -59,6 +81,13 @@ class TV:
     def isInAction(self):
         return self.in_action
 
+    # TV state changed by other means (e.g., sound muted by hand); follow it, so that the next action does not undo it
+    def syncAction(self):
+        in_action = self.in_action
+        self.setAction(self.action)
+        if self.in_action != in_action:
+            LOGGER.info(f'TV {"muted" if self.in_action else "unmuted"} by other means')
+
     def startAction(self):
         if self.action == 'lower_volume':
             if self.volume:
@@ -73,27 +102,47 @@ class TV:
         self.in_action = not(self.tvc.restoreVolume() if self.action == 'lower_volume' else self.tvc.toggleMute())
         return not(self.in_action)
 
-    def getTimeSinceLastAction(self):
-        return datetime.now() - self.last_action_time
-
-    # Run next detection no earlier that REC_OFFSET seconds
-    def OKToDetect(self):
-        global REC_OFFSET_TD
+    # Asynchronous TV control reports results after the fact; on failure get back in sync with the real TV state
+    def actionResult(self, command, ok, duration):
+        METRICS.observe('advent_tv_action_seconds', duration, command=command)
+        if not ok:
+            METRICS.inc('advent_tv_action_failures_total', command=command)
+            LOGGER.warning('Warning: TV action failed')
+            self.setAction(self.action)
+
+    def setClock(self, clock):
+        self.clock = clock
+        self.last_action_time = self.clock() - timedelta(seconds=TV_DEAD_TIME)
+
+    def getChannel(self):
+        return self.channel
+
+    def setChannel(self, channel):
+        self.channel = channel
+
+    # Channel to restrict the next recognition to, or None for the full database. With channel affinity, only every
+    # CHANNEL_PROBE-th window is matched against all channels, so that a channel change is still noticed
+    def getSearchChannel(self):
+        global CHANNEL_PROBE
+
+        if CHANNEL_PROBE == 0 or self.channel is None:
+            return None
+        self.channel_lock.acquire()
+        self.channel_windows += 1
+        probe = self.channel_windows >= CHANNEL_PROBE
+        if probe:
+            self.channel_windows = 0
+        self.channel_lock.release()
+        return None if probe else self.channel
 
-        curr_time = datetime.now()
-        ok = False
-        self.detection_lock.acquire()
-        if curr_time - self.last_detection_time >= REC_OFFSET_TD:
-            self.last_detection_time = curr_time
-            ok = True
-        self.detection_lock.release()
-        return ok
+    def getTimeSinceLastAction(self):
+        return self.clock() - self.last_action_time
 
     # Disable TV actions for TV_DEAD_TIME seconds
     def OKToAct(self):
         global TV_DEAD_TIME_TD
 
-        curr_time = datetime.now()
+        curr_time = self.clock()
         ok = False
         self.action_lock.acquire()
         if curr_time - self.last_action_time >= TV_DEAD_TIME_TD:
@@ -103,63 +152,354 @@ class TV:
         return ok
 
 
+# Window scheduler
+## Hands out recognition windows evenly staggered over the input. Slots are counted in captured frames rather than in
+## wall-clock time, so window starts have no timer jitter, and threads simply block until the audio of their window arrives
+class WindowScheduler:
+
+    def __init__(self, capture):
+        self.capture = capture
+        self.lock = threading.Lock()
+        self.next_start = None      # (frames)
+        self.deadband = None        # (s) - measured; REC_DEADBAND is used until the first measurement
+        self.rec_offset = REC_OFFSET
+        self.keeping_up = True
+
+    # Start of the next window to recognize
+    def nextWindow(self):
+        global REC_INTERVAL
+
+        window_length = int(REC_INTERVAL * AudioCapture.SAMPLE_RATE)
+        offset_length = int(self.rec_offset * AudioCapture.SAMPLE_RATE)
+        self.lock.acquire()
+        position = self.capture.position()
+        if self.next_start is None or self.next_start + window_length < position - offset_length:
+            self.next_start = position    # start or resynchronize after falling behind
+        window_start = self.next_start
+        self.next_start += offset_length
+        self.lock.release()
+        return window_start
+
+    # Adapt the offset between windows to the measured recognition time after the end of a window (Dejavu deadband)
+    def updateDeadband(self, deadband):
+        global REC_INTERVAL
+        global NUM_THREADS
+
+        self.lock.acquire()
+        self.deadband = deadband if self.deadband is None else self.deadband + DEADBAND_SMOOTHING * (deadband - self.deadband)
+        self.rec_offset = (REC_INTERVAL + self.deadband) / NUM_THREADS
+        keeping_up = NUM_THREADS == 1 or self.rec_offset <= REC_INTERVAL    # with a single thread gaps are unavoidable
+        changed = keeping_up != self.keeping_up
+        self.keeping_up = keeping_up
+        self.lock.release()
+
+        if changed:
+            if keeping_up:
+                LOGGER.info(f'Recognition keeps up again: deadband is {round(self.deadband, 2)} s, thread offset is {round(self.rec_offset, 2)} s')
+            else:
+                LOGGER.warning(f'Warning: recognition deadband of {round(self.deadband, 2)} s is too long for {NUM_THREADS} threads; parts of input are not recognized')
+
+
 # Recognizer
 class RecognizerThread(threading.Thread):
 
-    def __init__(self, tv):
+    def __init__(self, tv, capture, pool = None, scheduler = None):
         threading.Thread.__init__(self)
         self.tv = tv
-        self.djv = Dejavu(DJV_CONFIG)
+        self.capture = capture
+        self.pool = pool
+        self.scheduler = scheduler
+        self.last_hit = None
+        self.deadband = 0           # (s) - recognition time of the last window
+        self.skipped = 0            # windows not recognized for being too quiet
+        if self.pool is None:
+            self.djv = Dejavu(DJV_CONFIG)
+            if HASH_INDEX is not None:
+                self.djv.db = HASH_INDEX    # during recognition Dejavu only calls return_matches() and get_song_by_id() on its database
 
     def run(self):
         while True:
-            # Space the threads in time
-            if self.tv.OKToDetect():
-                start_time = datetime.now().strftime('%H:%M:%S,%f')[:-3]
-                matches = self.djv.recognize(MicrophoneRecognizer, seconds=REC_INTERVAL)[0]
-                end_time = datetime.now().strftime('%H:%M:%S,%f')[:-3]
-                if len(matches):
-                    best_match = matches[0]
-                    LOGGER.debug(f'Recognition start={start_time}, end={end_time}, match {best_match["song_name"].decode("utf-8")}, {int(best_match["fingerprinted_confidence"] * 100)}% confidence')
-                    if best_match["fingerprinted_confidence"] >= REC_CONFIDENCE / 100:
-                        print('O', end='', flush=True)     # strong match
-                        if self.tv.OKToAct():
-                            print('')
-                            LOGGER.info(f'Hit: {best_match["song_name"].decode("utf-8")}')
-                            flags = int(best_match["song_name"].decode("utf-8").split('_')[4])
-                            ad_start = bool(flags & 0b0001)
-                            ad_end = bool(flags & 0b0010)
-
-                            if self.tv.isInAction():
-                                if ad_end:
-                                    if self.tv.stopAction():
-                                        LOGGER.info('TV volume restored' if self.tv.getAction() == 'lower_volume' else 'TV unmuted')
-                                    else:
-                                        LOGGER.warning('Warning: TV action failed')
+            window_start = self.scheduler.nextWindow()
+            matches = self.recognizeWindow(window_start)
+            if matches is not None:
+                self.scheduler.updateDeadband(self.deadband)
+                self.processMatches(matches, self.capture.getTime(window_start).strftime('%H:%M:%S,%f')[:-3], datetime.now().strftime('%H:%M:%S,%f')[:-3])
+
+    # Pick the part of the in-memory index to match against: only jingles able to change TV state, and only of the
+    # channel watched if channel affinity is on. Returns the partition as (channel, flags)
+    def selectPartition(self):
+        if HASH_INDEX is None:
+            return (None, None)
+        partition = (self.tv.getSearchChannel(), HashIndex.AD_END if self.tv.isInAction() else HashIndex.AD_START)
+        if self.pool is None:
+            self.djv.db = HASH_INDEX.getPartition(*partition)
+        return partition
+
+    # Level gate: fingerprinting and matching silence or near-silence is a waste of CPU
+    def isSilent(self, start, length):
+        level = AudioCapture.getLevel(self.capture.getView(start, length))
+        if level >= REC_GATE:
+            return False
+        self.skipped += 1
+        METRICS.inc('advent_skipped_windows_total')
+        trace('skip', start, length, level=round(float(level), 1) if math.isfinite(level) else None)
+        LOGGER.debug(f'Recognition skipped, input level {round(level, 1)} dBFS')
+        print('_', end='', flush=True)     # silence
+        return True
+
+    # Recognize REC_INTERVAL seconds of input starting at a given frame; None if the input is lost or silent
+    def recognizeWindow(self, window_start):
+        window_length = int(REC_INTERVAL * AudioCapture.SAMPLE_RATE)
+        if not self.capture.waitWindow(window_start, window_length):
+            LOGGER.warning('Warning: audio capture overrun; recognition window lost')
+            METRICS.inc('advent_lost_windows_total')
+            trace('lost', window_start, window_length)
+            return None
+        METRICS.observe('advent_scheduler_lag_seconds', max(0, (datetime.now() - self.capture.getTime(window_start + window_length)).total_seconds()))
+        if self.isSilent(window_start, window_length):
+            return None
+        window_end = time.monotonic()
+        if self.pool is None:
+            self.selectPartition()
+            matches = self.collectResult(self.djv.recognize(BufferRecognizer, self.capture.getView(window_start, window_length)), window_start, window_length)
+        else:
+            matches = self.collectResult(self.pool.recognize(window_start, window_length, self.selectPartition()), window_start, window_length)    # TV decisions are still taken here, in the parent process
+        self.deadband = time.monotonic() - window_end
+        METRICS.observe('advent_stage_seconds', self.deadband, stage='window')
+        if self.capture.isOverrun(window_start):
+            LOGGER.warning('Warning: audio capture overrun during recognition; consider increasing buffer')
+        return matches
+
+    # Dejavu recognition result is matches and stage times (s)
+    def collectResult(self, result, window_start, window_length):
+        matches, fingerprint_time, query_time, align_time = result
+        METRICS.inc('advent_windows_total')
+        METRICS.observe('advent_stage_seconds', fingerprint_time, stage='fingerprint')
+        METRICS.observe('advent_stage_seconds', query_time, stage='query')
+        METRICS.observe('advent_stage_seconds', align_time, stage='align')
+        trace('window', window_start, window_length, fingerprint=round(float(fingerprint_time), 4), query=round(float(query_time), 4), align=round(float(align_time), 4),
+            matches=[{'name': match["song_name"].decode("utf-8"), 'confidence': float(match["fingerprinted_confidence"]), 'offset': int(match["offset"])} for match in matches[:TRACE_MATCHES]])
+        return matches
+
+    def processMatches(self, matches, start_time, end_time):
+        if len(matches):
+            best_match = matches[0]
+            METRICS.observe('advent_confidence', best_match["fingerprinted_confidence"])
+            LOGGER.debug(f'Recognition start={start_time}, end={end_time}, match {best_match["song_name"].decode("utf-8")}, {int(best_match["fingerprinted_confidence"] * 100)}% confidence')
+            if best_match["fingerprinted_confidence"] >= REC_CONFIDENCE / 100:
+                print('O', end='', flush=True)     # strong match
+                if CHANNEL_PROBE != 0:
+                    channel = HashIndex.getChannel(best_match["song_name"].decode("utf-8"))
+                    if channel != self.tv.getChannel():
+                        LOGGER.debug(f'Channel affinity set to {channel}')
+                        self.tv.setChannel(channel)
+                if self.tv.OKToAct():
+                    print('')
+                    LOGGER.info(f'Hit: {best_match["song_name"].decode("utf-8")}')
+                    self.last_hit = best_match["song_name"].decode("utf-8")
+                    flags = int(best_match["song_name"].decode("utf-8").split('_')[4])
+                    ad_start = bool(flags & 0b0001)
+                    ad_end = bool(flags & 0b0010)
+                    trace('hit', name=self.last_hit, confidence=float(best_match["fingerprinted_confidence"]), in_action=self.tv.isInAction())
+
+                    if self.tv.isInAction():
+                        if ad_end:
+                            if self.tv.stopAction():
+                                LOGGER.info('TV volume restored' if self.tv.getAction() == 'lower_volume' else 'TV unmuted')
                             else:
-                                if ad_start:
-                                    if self.tv.startAction():
-                                        LOGGER.info('TV volume lowered' if self.tv.getAction() == 'lower_volume' else 'TV muted')
-                                    else:
-                                        LOGGER.warning('Warning: TV action failed')
+                                LOGGER.warning('Warning: TV action failed')
                     else:
-                      if best_match["fingerprinted_confidence"] > 0:
-                          print('o', end='', flush=True) # weak match
-                      else:
-                          print(':', end='', flush=True) # no match
-                else:
-                   LOGGER.debug(f'Recognition start={start_time}, end={end_time}, no matches')
-                   print('.', end='', flush=True)   # no signal
+                        if ad_start:
+                            if self.tv.startAction():
+                                LOGGER.info('TV volume lowered' if self.tv.getAction() == 'lower_volume' else 'TV muted')
+                            else:
+                                LOGGER.warning('Warning: TV action failed')
             else:
-                time.sleep(0.1)
+              if best_match["fingerprinted_confidence"] > 0:
+                  print('o', end='', flush=True) # weak match
+              else:
+                  print(':', end='', flush=True) # no match
+        else:
+           LOGGER.debug(f'Recognition start={start_time}, end={end_time}, no matches')
+           print('.', end='', flush=True)   # no signal
+
+# Streaming recognizer
+## Fingerprints the input once, incrementally, and matches a sliding window of hashes every REC_HOP seconds
+class StreamRecognizerThread(RecognizerThread):
+
+    def __init__(self, tv, capture):
+        super().__init__(tv, capture)
+        self.hop_columns = max(2, round(REC_HOP * AudioCapture.SAMPLE_RATE / StreamFingerprinter.HOP))
+        self.window_columns = round(REC_INTERVAL * AudioCapture.SAMPLE_RATE / StreamFingerprinter.HOP)
+        self.restart(0)
+
+    def restart(self, portion_start):
+        self.fingerprinters = [StreamFingerprinter(AudioCapture.SAMPLE_RATE) for channel in range(self.capture.channels)]
+        self.hashes = [deque() for channel in range(self.capture.channels)]    # ordered by offset within a channel
+        self.portion_start = portion_start
+
+    def run(self):
+        self.restart(self.capture.position())
+        while True:
+            self.step()
+
+    # End of input needed for the next step
+    def getNextPortionEnd(self):
+        return self.portion_start + StreamFingerprinter.getPortionLength(self.hop_columns)
+
+    # Fingerprint next REC_HOP seconds of input and match the window
+    def step(self):
+        portion = self.capture.getWindow(self.portion_start, StreamFingerprinter.getPortionLength(self.hop_columns))
+        if portion is None:
+            LOGGER.warning('Warning: audio capture overrun; restarting stream fingerprinting')
+            METRICS.inc('advent_lost_windows_total')
+            self.restart(self.capture.position())
+            return
+        METRICS.observe('advent_scheduler_lag_seconds', max(0, (datetime.now() - self.capture.getTime(self.portion_start + portion.shape[1])).total_seconds()))
+        if self.isSilent(self.portion_start, portion.shape[1]):
+            self.restart(self.portion_start + self.hop_columns * StreamFingerprinter.HOP)    # continuity of the stream is lost anyway
+            return
+        portion_end = self.portion_start + portion.shape[1]
+        self.portion_start += self.hop_columns * StreamFingerprinter.HOP
+
+        start_time = datetime.now().strftime('%H:%M:%S,%f')[:-3]
+        fingerprint_time = time.monotonic()
+        for fingerprinter, channel, channel_hashes in zip(self.fingerprinters, portion, self.hashes):
+            channel_hashes.extend(fingerprinter.process(channel))
+        fingerprint_time = time.monotonic() - fingerprint_time
+
+        # Keep hashes of the last REC_INTERVAL seconds only
+        window_hashes = set()
+        newest = max([channel_hashes[-1][1] for channel_hashes in self.hashes if len(channel_hashes)], default=0)
+        for channel_hashes in self.hashes:
+            while len(channel_hashes) and channel_hashes[0][1] <= newest - self.window_columns:
+                channel_hashes.popleft()
+            window_hashes.update(channel_hashes)
+
+        self.selectPartition()
+        matches, dedup_hashes, query_time = self.djv.find_matches(window_hashes)
+        align_time = time.monotonic()
+        matches = self.djv.align_matches(matches, dedup_hashes, len(window_hashes)) if len(matches) else []
+        window_length = min(portion_end, int(REC_INTERVAL * AudioCapture.SAMPLE_RATE))
+        matches = self.collectResult((matches, fingerprint_time, query_time, time.monotonic() - align_time), portion_end - window_length, window_length)
+        end_time = datetime.now().strftime('%H:%M:%S,%f')[:-3]
+        self.processMatches(matches, start_time, end_time)
+
+# Offline replay
+## Runs recognition over a recording as fast as possible. TV time follows the audio instead of the wall clock, so the
+## timeline of actions is the same as if the recording was played live (minus Dejavu deadband)
+class Replay:
+
+    def __init__(self, tv, capture, recognizer, fname):
+        self.tv = tv
+        self.capture = capture
+        self.recognizer = recognizer
+        self.fname = fname
+        self.now = 0              # (frames) - audio time of the decision being taken
+        self.timeline = []        # (time (s), TV in action, jingle name or None for timeout)
+        self.duration = 0         # (s) - audio replayed
+        self.tv.setClock(self.getTime)
+
+    def getTime(self):
+        return datetime(1970, 1, 1) + timedelta(seconds=self.now / AudioCapture.SAMPLE_RATE)
+
+    def getTimestamp(self, seconds = None):
+        if seconds is None:
+            seconds = self.now / AudioCapture.SAMPLE_RATE
+        return f'{int(seconds // 3600)}:{int(seconds % 3600 // 60):02}:{seconds % 60:04.1f}'
+
+    def run(self, report = True):
+        window_start = 0
+        window_length = int(REC_INTERVAL * AudioCapture.SAMPLE_RATE)
+        window_offset = int(REC_OFFSET * AudioCapture.SAMPLE_RATE)
+        start_time = time.time()
+
+        for chunk in readAudioChunks(self.fname, self.capture.channels, AudioCapture.SAMPLE_RATE):
+            self.capture.write(chunk)
+            if isinstance(self.recognizer, StreamRecognizerThread):
+                while self.capture.position() >= self.recognizer.getNextPortionEnd():
+                    self.now = self.recognizer.getNextPortionEnd()
+                    self.decide(self.recognizer.step)
+            else:
+                # All windows available are recognized at once, so that process workers can run them in parallel
+                windows = []
+                while self.capture.position() >= window_start + window_length:
+                    if self.recognizer.pool is not None and not self.recognizer.isSilent(window_start, window_length):
+                        windows.append((window_start, self.recognizer.pool.recognizeAsync(window_start, window_length, self.recognizer.selectPartition())))
+                    else:
+                        windows.append((window_start, None))
+                    window_start += window_offset
+                for start, result in windows:
+                    self.now = start + window_length
+                    if result is not None:
+                        matches = self.recognizer.collectResult(result.get(), start, window_length)
+                    else:
+                        matches = self.recognizer.recognizeWindow(start) if self.recognizer.pool is None else None
+                    self.decide(lambda: self.recognizer.processMatches(matches, self.getTimestamp(), self.getTimestamp()) if matches is not None else None)
+
+        self.duration = self.capture.position() / AudioCapture.SAMPLE_RATE
+        elapsed = time.time() - start_time
+        if report:
+            print('')
+            LOGGER.info(f'Replay timeline of {self.fname}:')
+            for seconds, in_action, name in self.timeline:
+                LOGGER.info(f'  {self.getTimestamp(seconds)} {self.describeAction(in_action):16} {name if name != None else "(timeout)"}')
+            if not len(self.timeline):
+                LOGGER.info('  no actions')
+            if self.recognizer.skipped:
+                LOGGER.info(f'Skipped {self.recognizer.skipped} silent windows')
+            LOGGER.info(f'Replayed {timedelta(seconds=round(self.duration))} of audio in {timedelta(seconds=round(elapsed))}' + (f' ({round(self.duration / elapsed, 1)}x real time)' if elapsed > 0 else ''))
+        return self.timeline
+
+    # Run recognition step and record TV state changes, including those on action timeout
+    def decide(self, step):
+        in_action = self.tv.isInAction()
+        self.recognizer.last_hit = None
+        step()
+        if self.tv.isInAction() != in_action:
+            self.timeline.append((self.now / AudioCapture.SAMPLE_RATE, self.tv.isInAction(), self.recognizer.last_hit))
+        elif MUTE_TIMEOUT != 0 and self.tv.isInAction() and self.tv.getTimeSinceLastAction() >= MUTE_TIMEOUT_TD and self.tv.OKToAct():
+            if self.tv.stopAction():
+                self.timeline.append((self.now / AudioCapture.SAMPLE_RATE, self.tv.isInAction(), None))
+
+    def describeAction(self, in_action):
+        if self.tv.getAction() == 'lower_volume':
+            return 'volume lowered' if in_action else 'volume restored'
+        return 'muted' if in_action else 'unmuted'
+
+# Record an event into the trace, if it is on. Window bounds are given in frames and stored in seconds of input
+def trace(event, window_start = None, window_length = None, **fields):
+    if TRACE is not None:
+        record = {'event': event, 'time': round(time.monotonic(), 3), 'thread': threading.current_thread().name}
+        if window_start is not None:
+            record['start'] = round(window_start / AudioCapture.SAMPLE_RATE, 3)
+            record['end'] = round((window_start + window_length) / AudioCapture.SAMPLE_RATE, 3)
+        record.update(fields)
+        TRACE.write(record)
+
+# Apply recognition settings without validation (used by benchmark)
+def configure(num_threads, rec_interval, rec_confidence):
+    global NUM_THREADS
+    global REC_INTERVAL
+    global REC_CONFIDENCE
+    global REC_OFFSET
+
+    NUM_THREADS = num_threads
+    REC_INTERVAL = rec_interval
+    REC_CONFIDENCE = rec_confidence
+    REC_OFFSET = (REC_INTERVAL + REC_DEADBAND) / NUM_THREADS
 
 def main():
     global DJV_CONFIG
+    global HASH_INDEX
+    global TRACE
     global NUM_THREADS
     global REC_INTERVAL
     global REC_CONFIDENCE
+    global REC_HOP
+    global REC_GATE
     global REC_OFFSET
-    global REC_OFFSET_TD
+    global CHANNEL_PROBE
     global MUTE_TIMEOUT
     global MUTE_TIMEOUT_TD
 
@@ -174,6 +514,16 @@ def main():
     parser.add_argument('-n', '--num_threads', help=f'run N recognition threads (default: {NUM_THREADS})', type=int)
     parser.add_argument('-i', '--rec_interval', help=f'audio recognition interval (s) (default: {REC_INTERVAL})', type=float)
     parser.add_argument('-c', '--rec_confidence', help=f'audio recognition confidence (%%) (default: {REC_CONFIDENCE})', type=int)
+    parser.add_argument('-s', '--stream', help='fingerprint the input continuously in one thread instead of overlapping windows', action='store_true')
+    parser.add_argument('-H', '--rec_hop', help=f'matching period in streaming mode (s) (default: {REC_HOP})', type=float)
+    parser.add_argument('-w', '--workers', help='run recognition in threads or in a pool of processes (default: thread)', choices=['thread', 'process'], default='thread')
+    parser.add_argument('-g', '--gate', metavar='DBFS', help=f'skip recognition of input quieter than DBFS (dB) (default: {REC_GATE})', type=float)
+    parser.add_argument('-D', '--database', metavar='FILE', help='use an embedded database file (SQLite) instead of the database server', type=str)
+    parser.add_argument('-x', '--in_memory', help='load fingerprints into memory at startup and recognize without database queries', action='store_true')
+    parser.add_argument('-A', '--affinity', metavar='N', help='after a hit, match only jingles of the same channel, with full database probe every N-th window (default: off; requires -x)', type=int)
+    parser.add_argument('-T', '--trace', metavar='FILE', help='append a trace of recognition events into a JSON lines file', type=str)
+    parser.add_argument('-M', '--metrics', metavar='PORT', help='serve metrics for Prometheus on http://localhost:PORT/metrics', type=int)
+    parser.add_argument('-r', '--replay', metavar='FILE', help='run recognition over a recording (WAV, raw PCM or FLAC) as fast as possible and print a timeline of actions', type=str)
     parser.add_argument('-l', '--log', help='log events into a file (default: none)', choices=['none', 'events', 'debug'], default='none')
     args = parser.parse_args()
 
@@ -195,14 +545,25 @@ def main():
     with open(resource_filename(Requirement.parse("PyDejavu"),"dejavu_py/dejavu.cnf")) as dejavu_cnf:
         DJV_CONFIG = json.load(dejavu_cnf)
         LOGGER.debug(f'Dejavu config {dejavu_cnf.name} loaded')
+        if args.database != None:
+            if not os.path.isfile(args.database):
+                LOGGER.error(f'Error: database file {args.database} not found')
+                return 1
+            SQLiteDatabase.register()
+            DJV_CONFIG = {**DJV_CONFIG, 'database_type': SQLiteDatabase.type, 'database': {'database': args.database}}
+            LOGGER.info(f'Using embedded database {args.database}')
 
         # TV controls
+        if args.replay != None:
+            args.tv_control = 'nil'     # replay shall never touch a real TV
         if args.tv_control == 'pulseaudio':
             tvc = TVControlPulseAudio()
         elif args.tv_control == 'harmonyhub':
             tvc = TVControlHarmonyHub()
         else:
             tvc = TVControl()
+        if args.replay == None:
+            tvc = TVActuator(tvc)       # do not block recognition while the TV is being driven
         tv = TV(tvc, args.action, args.volume if args.volume != None else '')
 
         if args.mute_timeout != None:
@@ -229,7 +590,6 @@ def main():
                     LOGGER.warning(f'Warning: recognition interval of {args.rec_interval} s will result in no matches')
                 REC_INTERVAL = args.rec_interval
                 REC_OFFSET = (REC_INTERVAL + REC_DEADBAND) / NUM_THREADS
-                REC_OFFSET_TD = timedelta(seconds=REC_OFFSET)
 
         if args.rec_confidence != None:
             if args.rec_confidence < 0 or args.rec_confidence > 100:
@@ -240,6 +600,42 @@ def main():
                 REC_CONFIDENCE = args.rec_confidence
         LOGGER.info(f'Recognition interval is {REC_INTERVAL} s with confidence of {REC_CONFIDENCE}%')
 
+        if args.rec_hop != None:
+            if not args.stream:
+                LOGGER.warning('Warning: matching period is only used in streaming mode; ignoring')
+            elif args.rec_hop <= 0:
+                LOGGER.error(f'Error: invalid matching period: {args.rec_hop}; ignoring')
+            else:
+                if args.rec_hop > REC_INTERVAL:
+                    LOGGER.warning(f'Warning: matching period of {args.rec_hop} s is longer than recognition interval; parts of input will not be matched')
+                REC_HOP = args.rec_hop
+
+        if args.gate != None:
+            if args.gate > 0:
+                LOGGER.error(f'Error: invalid input level gate: {args.gate} dBFS; ignoring')
+            else:
+                if args.gate > -30:
+                    LOGGER.warning(f'Warning: input level gate of {args.gate} dBFS may skip jingles')
+                REC_GATE = args.gate
+        LOGGER.debug(f'Input level gate is {REC_GATE} dBFS')
+
+        # Fingerprint index
+        if args.in_memory:
+            HASH_INDEX = HashIndex()
+            HASH_INDEX.load(Dejavu(DJV_CONFIG).db)
+            LOGGER.info(f'Loaded {HASH_INDEX.getNumFingerprints()} fingerprints of {HASH_INDEX.getNumSongs()} tracks into memory')
+
+        if args.affinity != None:
+            if args.affinity < 2:    # probing every window is no affinity
+                LOGGER.error(f'Error: invalid channel affinity probe period: {args.affinity} (shall be 2 or more); ignoring')
+            elif HASH_INDEX is None:
+                LOGGER.warning('Warning: channel affinity requires in-memory fingerprints (-x); ignoring')
+            else:
+                CHANNEL_PROBE = args.affinity
+                LOGGER.info(f'Channel affinity is on with full database probe every {CHANNEL_PROBE} windows')
+        if HASH_INDEX is not None:
+            HASH_INDEX.buildPartitions(CHANNEL_PROBE != 0)    # before worker processes are forked
+
         # Thread control
         if args.num_threads != None:
             if args.num_threads < 1:
@@ -249,14 +645,53 @@ def main():
                     LOGGER.warning(f'Warning: too high number of threads requested: {args.num_threads}; risk of system saturation')
                 NUM_THREADS = args.num_threads
                 REC_OFFSET = (REC_INTERVAL + REC_DEADBAND) / NUM_THREADS
-                REC_OFFSET_TD = timedelta(seconds=REC_OFFSET)
 
         # Launch threads
-        for n in range(0, NUM_THREADS):
-            thread = RecognizerThread(tv)
+        if args.stream and args.workers == 'process':
+            LOGGER.warning('Warning: process workers are not used in streaming mode; ignoring')
+            args.workers = 'thread'
+        capture = AudioCapture(REC_INTERVAL + REC_BUFFER, shared = args.workers == 'process')
+        pool = RecognizerPool(NUM_THREADS, capture, DJV_CONFIG, HASH_INDEX) if args.workers == 'process' else None    # fork before any thread starts
+        if args.trace != None:
+            try:
+                TRACE = TraceWriter(args.trace)
+                TRACE.start()
+                LOGGER.info(f'Tracing recognition into {args.trace}')
+            except OSError as e:
+                LOGGER.error(f'Error: cannot open trace file {args.trace}: {e}')
+
+        if args.replay != None:
+            recognizer = StreamRecognizerThread(tv, capture) if args.stream else RecognizerThread(tv, capture, pool)
+            LOGGER.info(f'Replaying {args.replay}')
+            try:
+                Replay(tv, capture, recognizer, args.replay).run()
+            except (OSError, ValueError, EOFError, wave.Error) as e:
+                LOGGER.error(f'Error: cannot replay {args.replay}: {e}')
+                return 1
+            return 0
+
+        tvc.on_result = tv.actionResult
+        tvc.start()
+        if args.metrics != None:
+            try:
+                METRICS.serve(args.metrics)
+                LOGGER.info(f'Serving metrics on http://localhost:{args.metrics}/metrics')
+            except OSError as e:
+                LOGGER.error(f'Error: cannot serve metrics on port {args.metrics}: {e}')
+        capture.start()
+        if args.stream:
+            if args.num_threads != None:
+                LOGGER.warning('Warning: number of threads is not used in streaming mode; ignoring')
+            thread = StreamRecognizerThread(tv, capture)
             thread.start()
-        LOGGER.info(f'Started {NUM_THREADS} listening thread(s)')
-        LOGGER.debug(f'Thread offset is {REC_OFFSET} s')
+            LOGGER.info(f'Started streaming recognition with matching every {REC_HOP} s')
+        else:
+            scheduler = WindowScheduler(capture)
+            for n in range(0, NUM_THREADS):
+                thread = RecognizerThread(tv, capture, pool, scheduler)
+                thread.start()
+            LOGGER.info(f'Started {NUM_THREADS} listening thread(s)' + (' with recognition in worker processes' if pool is not None else ''))
+            LOGGER.debug(f'Initial thread offset is {REC_OFFSET} s')
 
         # If action timeout is activated, monitor actions
         if MUTE_TIMEOUT != 0:
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import io
+import csv
+import json
+import time
+import platform
+import argparse
+import contextlib
+from pkg_resources import Requirement, resource_filename
+from dejavu import Dejavu
+from advent import __version__
+from advent import advent
+from advent.AudioCapture import AudioCapture
+from advent.HashIndex import HashIndex
+from advent.SQLiteDatabase import SQLiteDatabase
+from tv_control.TVControl import TVControl
+
+# Settings
+VERSION=__version__
+TOLERANCE = 10            # (s) - max delay between jingle onset and TV action for the action to count as a detection
+
+# Annotations are kept next to the recording, in a CSV file with the same name: one row per ad jingle
+# with its onset time (s) and its kind ("start" for ad break start, "end" for ad break end)
+def load_annotations(fname):
+    annotations = []
+    with open(os.path.splitext(fname)[0] + '.csv', newline='') as ann_file:
+        for row in csv.reader(ann_file):
+            if not len(row) or row[0].startswith('#'):
+                continue
+            try:
+                onset = float(row[0])
+            except ValueError:
+                continue          # header
+            kind = row[1].strip()
+            if kind not in ('start', 'end'):
+                raise ValueError(f'{ann_file.name}: unknown jingle kind \'{kind}\'')
+            annotations.append((onset, kind == 'start'))
+    return sorted(annotations)
+
+# Match TV actions against annotations. Timeout actions are not detections and are ignored
+def evaluate(timeline, annotations, tolerance):
+    actions = [(seconds, in_action) for seconds, in_action, name in timeline if name != None]
+    used = set()
+    latencies = []
+    missed = 0
+    for onset, ad_start in annotations:
+        for n, (seconds, in_action) in enumerate(actions):
+            if n not in used and in_action == ad_start and onset <= seconds <= onset + tolerance:
+                used.add(n)
+                latencies.append(seconds - onset)
+                break
+        else:
+            missed += 1
+    return latencies, missed, len(actions) - len(used)
+
+def replay(fname, stream):
+    tv = advent.TV(TVControl())
+    capture = AudioCapture(advent.REC_INTERVAL + advent.REC_BUFFER)
+    recognizer = advent.StreamRecognizerThread(tv, capture) if stream else advent.RecognizerThread(tv, capture)
+    rep = advent.Replay(tv, capture, recognizer, fname)
+    cpu_time = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):    # progress characters
+        timeline = rep.run(report=False)
+    return timeline, time.process_time() - cpu_time, rep.duration
+
+def parse_list(value, conv):
+    return [conv(v) for v in value.split(',')]
+
+def main():
+
+    ## Command-line parser
+    parser = argparse.ArgumentParser(description='Benchmark AdVent jingle detection on annotated recordings',
+        epilog='Each recording needs an annotation file with the same name and .csv extension, with rows "ONSET,start|end" (s). Detections later than the tolerance after jingle onset count as misses')
+    parser.add_argument('-v', '--version', action='version', version=VERSION)
+    parser.add_argument('recording', metavar='FILE', help='recording to replay (WAV, raw PCM or FLAC)', nargs='+')
+    parser.add_argument('-n', '--num_threads', help=f'comma-separated numbers of recognition threads to try (default: {advent.NUM_THREADS})', default=str(advent.NUM_THREADS))
+    parser.add_argument('-i', '--rec_interval', help=f'comma-separated recognition intervals to try (s) (default: {advent.REC_INTERVAL})', default=str(advent.REC_INTERVAL))
+    parser.add_argument('-c', '--rec_confidence', help=f'comma-separated recognition confidences to try (%%) (default: {advent.REC_CONFIDENCE})', default=str(advent.REC_CONFIDENCE))
+    parser.add_argument('-s', '--stream', help='benchmark streaming recognition (number of threads is not used)', action='store_true')
+    parser.add_argument('-D', '--database', metavar='FILE', help='use an embedded database file (SQLite) instead of the database server', type=str)
+    parser.add_argument('-x', '--in_memory', help='load fingerprints into memory at startup and recognize without database queries', action='store_true')
+    parser.add_argument('-A', '--affinity', metavar='N', help='benchmark channel affinity with full database probe every N-th window (requires -x)', type=int, default=0)
+    parser.add_argument('-t', '--tolerance', help=f'max detection latency (s) (default: {TOLERANCE})', type=float, default=TOLERANCE)
+    parser.add_argument('-o', '--output', help='also write results into a CSV file', type=str)
+    args = parser.parse_args()
+
+    try:
+        nums_threads = [1] if args.stream else parse_list(args.num_threads, int)
+        rec_intervals = parse_list(args.rec_interval, float)
+        rec_confidences = parse_list(args.rec_confidence, int)
+        annotations = {fname: load_annotations(fname) for fname in args.recording}
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return 1
+
+    with open(resource_filename(Requirement.parse("PyDejavu"),"dejavu_py/dejavu.cnf")) as dejavu_cnf:
+        advent.DJV_CONFIG = json.load(dejavu_cnf)
+    if args.database != None:
+        if not os.path.isfile(args.database):
+            print(f'Error: database file {args.database} not found', file=sys.stderr)
+            return 1
+        SQLiteDatabase.register()
+        advent.DJV_CONFIG = {**advent.DJV_CONFIG, 'database_type': SQLiteDatabase.type, 'database': {'database': args.database}}
+    if args.affinity == 1 or args.affinity < 0:    # probing every window is no affinity
+        print(f'Error: invalid channel affinity probe period: {args.affinity} (shall be 2 or more, or 0 for none)', file=sys.stderr)
+        return 1
+    if args.in_memory:
+        advent.HASH_INDEX = HashIndex()
+        advent.HASH_INDEX.load(Dejavu(advent.DJV_CONFIG).db)
+        if args.affinity > 1:
+            advent.CHANNEL_PROBE = args.affinity
+        advent.HASH_INDEX.buildPartitions(advent.CHANNEL_PROBE != 0)
+    elif args.affinity > 1:
+        print('Warning: channel affinity requires in-memory fingerprints (-x); ignoring', file=sys.stderr)
+
+    print(f'AdVent benchmark v{VERSION} on {platform.machine()} x {os.cpu_count()}, Python {platform.python_version()}' + (', in-memory fingerprints' if args.in_memory else '') + (f', channel affinity {advent.CHANNEL_PROBE}' if advent.CHANNEL_PROBE else ''))
+    print(f'{len(args.recording)} recording(s), {sum([len(a) for a in annotations.values()])} annotated jingle(s), tolerance {args.tolerance} s')
+    print('')
+    header = ['n', 'i', 'c', 'CPU/s', 'lat.avg', 'lat.max', 'hits', 'missed', 'false', 'precision', 'recall']
+    print(''.join([f'{h:>10}' for h in header]))
+
+    results = []
+    for num_threads in nums_threads:
+        for rec_interval in rec_intervals:
+            for rec_confidence in rec_confidences:
+                advent.configure(num_threads, rec_interval, rec_confidence)
+                latencies = []
+                missed = 0
+                false_hits = 0
+                cpu_time = 0
+                duration = 0
+                for fname in args.recording:
+                    timeline, rec_cpu_time, rec_duration = replay(fname, args.stream)
+                    rec_latencies, rec_missed, rec_false_hits = evaluate(timeline, annotations[fname], args.tolerance)
+                    latencies += rec_latencies
+                    missed += rec_missed
+                    false_hits += rec_false_hits
+                    cpu_time += rec_cpu_time
+                    duration += rec_duration
+
+                hits = len(latencies)
+                result = [
+                    '-' if args.stream else num_threads, rec_interval, rec_confidence,
+                    round(cpu_time / duration, 3) if duration else 'n/a',
+                    round(sum(latencies) / hits, 2) if hits else 'n/a',
+                    round(max(latencies), 2) if hits else 'n/a',
+                    hits, missed, false_hits,
+                    round(hits / (hits + false_hits), 2) if hits + false_hits else 'n/a',
+                    round(hits / (hits + missed), 2) if hits + missed else 'n/a'
+                ]
+                print(''.join([f'{str(r):>10}' for r in result]))
+                results.append(result)
+
+    if args.output != None:
+        with open(args.output, mode='w', newline='') as out_file:
+            out_writer = csv.writer(out_file)
+            out_writer.writerow(header)
+            out_writer.writerows(results)
+    return 0
+
+if __name__ == '__main__':
+    main()
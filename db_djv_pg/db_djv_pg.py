@@ -2,14 +2,38 @@
 
 import os
 import sys
+import io
+import time
+import random
 import argparse
+import sqlite3
+import re
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from psycopg2 import sql
 import csv
+import gzip
+import struct
+import concurrent.futures
+import numpy as np
 from alive_progress import alive_bar
 
 FORMAT = "djv"
-FORMAT_VERSION = 1
+FORMAT_VERSION = 2              # newest version supported
+FORMAT_VERSION_EXPORT = 1       # text format is friendlier to version control
+
+# .djv v2 layout (little endian):
+##   header: "djv", version (1 byte), compression (1 byte, index in COMPRESSIONS), fingerprinted (1 byte), hash size (2 bytes),
+##           number of fingerprints (8 bytes), total hashes (8 bytes), file SHA1 (20 bytes), name length (2 bytes)
+##   name (UTF-8), zero-padded to a multiple of 8 bytes
+##   payload, compressed as a whole if requested: offsets (uint32 each), then hashes (hash size bytes each)
+## Uncompressed payload can be mapped directly, e.g.: numpy.memmap(fname, dtype='<u4', mode='r', offset=payload_offset, shape=(n,))
+DJV2_HEADER = struct.Struct('<3sBBBHQQ20sH')
+COMPRESSIONS = ['none', 'gzip', 'zstd']
+
+MANIFEST = ".djv-manifest"      # cache of file headers at the top of a file tree
+MANIFEST_VERSION = 1
 
 # Must match Dejavu presets; see https://github.com/denis-stepanov/advent#dejavu-tuning
 DEFAULT_WINDOW_SIZE = 1024
@@ -21,52 +45,926 @@ DB_HOST = "localhost"
 DB_NAME = "advent"
 DB_USER = "advent"
 DB_PASSWORD = "advent"
+DB_FILE = None                  # embedded database file (SQLite) used instead of the server (-D)
 
 TERM_WIDTH = 50
 
+LOOKUP_INDEX = "ix_fingerprints_hash_lookup"  # covering index for recognition lookups
+BENCH_LOOKUPS = 200             # (-) - lookups made by the optimization benchmark
+BENCH_BATCH = 1000              # (-) - hashes per lookup (Dejavu queries hashes in batches of 1000)
+
+MAINTENANCE_TABLES = ['songs', 'fingerprints', 'djv_song_stats']
+MAINTENANCE_MIN_ROWS = 1000     # (rows) - changes to a table not calling for maintenance yet...
+MAINTENANCE_RATIO = 0.05        # (-) - ... or fraction of table rows
+
+## Rows changed since last vacuum (inserts count as well, as they need visibility map update) or analyze
+VACUUM_NEEDED = f"n_dead_tup + COALESCE((to_jsonb(t) ->> 'n_ins_since_vacuum')::BIGINT, 0) > {MAINTENANCE_MIN_ROWS} + {MAINTENANCE_RATIO} * n_live_tup"
+ANALYZE_NEEDED = f"n_mod_since_analyze > {MAINTENANCE_MIN_ROWS} + {MAINTENANCE_RATIO} * n_live_tup"
+
+CHECK_CONNECTIONS = 3           # (-) - database connections used to run health checks in parallel
+CHECK_TIMEOUT = 60              # (s) - default time limit of one health check
+
+JOBS_PER_WORKER = 4             # (-) - jobs per parallel worker
+EXPORT_FETCH_SIZE = 10000       # (rows) - fingerprints fetched at once during export
+
 def res_str(res = False):
     return 'FAILED' if res else 'OK'
 
-def print_check_result(msg = "UNKNOWN", res = False, offset = 2):
+def print_check_result(msg = "UNKNOWN", res = False, offset = 2, duration = None, status = None):
     for i in range(offset):
         print(" ", end = '')
     print(msg, end = '')
     for i in range(TERM_WIDTH - len(msg)):
         print(" ", end = '')
-    print(f": {res_str(res)}")
-
-# Return False or 0 if no issue
-def db_check(cursor, query, msg):
-    cursor.execute(query)
-    res = cursor.fetchone()[0]
-    print_check_result(msg, res)
-    return res
-
-def file_check(song_name, djv_reader):
+    print(f": {status if status != None else res_str(res)}", end = '')
+    print(f"{'':{8 - len(status if status != None else res_str(res))}}({duration:.2f} s)" if duration != None else "")
+
+# Health checks: name, query, cost class, AdVent-specific
+## By convention, a query shall return 0 or false() if no problem detected. Cheap checks only look at songs or at server
+## statistics; expensive ones go through all fingerprints
+CHECK_CHEAP = 'cheap'
+CHECK_EXPENSIVE = 'expensive'
+CHECKS = [
+    ("D0010: timestamps in future",
+        "SELECT COUNT(*) FROM songs s, fingerprints f WHERE f.song_id = s.song_id and GREATEST(s.date_created, s.date_modified, f.date_created, f.date_modified) > now()",
+        CHECK_EXPENSIVE, False),
+    ("D0011: created > modified",
+        "SELECT count(*) FROM (SELECT date_created FROM songs WHERE date_created > date_modified UNION SELECT date_created FROM fingerprints WHERE date_created > date_modified) AS dates",
+        CHECK_EXPENSIVE, False),
+    ("D0020: same song name, different SHA1",
+        "SELECT COUNT(*) FROM (SELECT song_name FROM songs GROUP BY song_name HAVING COUNT(DISTINCT file_sha1) > 1) AS names",
+        CHECK_CHEAP, False),
+    ("D0021: same SHA1, different song name",
+        "SELECT COUNT(*) FROM (SELECT file_sha1 FROM songs GROUP BY file_sha1 HAVING COUNT(DISTINCT song_name) > 1) AS sha1s",
+        CHECK_CHEAP, False),
+    ("D0030: fingerprinted without fingerprints",
+        "SELECT COUNT(*) FROM songs WHERE fingerprinted <> 0 AND total_hashes = 0",
+        CHECK_CHEAP, False),
+    ("D0035: fingerprint counts mismatch",
+        "SELECT (SELECT SUM(total_hashes) FROM songs) <> (SELECT COUNT(*) FROM fingerprints)",
+        CHECK_EXPENSIVE, False),
+    ("D0040: fingerprint hashes of variable size",
+        "SELECT (SELECT MIN(LENGTH(hash)) FROM fingerprints) <> (SELECT MAX(LENGTH(hash)) FROM fingerprints)",
+        CHECK_EXPENSIVE, False),
+    # n_ins_since_vacuum is missing in older Postgres
+    ("D0100: vacuum needed",
+        f"SELECT COUNT(*) FROM pg_stat_user_tables t WHERE relname IN ('songs', 'fingerprints') AND {VACUUM_NEEDED}",
+        CHECK_CHEAP, False),
+
+    ("A0010: non-fingerprinted tracks",
+        "SELECT COUNT(*) FROM songs WHERE fingerprinted = 0",
+        CHECK_CHEAP, True),
+    ("A0020: low confidence tracks",
+        "SELECT COUNT(*) FROM songs WHERE total_hashes < 500",
+        CHECK_CHEAP, True),
+    ("A0050: bad track name format",
+        "SELECT COUNT(*) FROM songs WHERE LENGTH(song_name) - LENGTH(translate(song_name, '_', '')) <> 4",
+        CHECK_CHEAP, True),
+    # Rudimentary check, because difficult to make it natively with Postgres
+    ("A0051: bad track date format",
+        "SELECT COUNT(*) FROM songs WHERE song_name LIKE '%\\_%\\_%\\_%\\_%' AND split_part(song_name, '_', 3) !~ '^\\d{2}(([0][1-9])|([1][0-2]))(([0-2][0-9])|([3][0-1]))$'",
+        CHECK_CHEAP, True),
+    ("A0080: bad flags",
+        "SELECT COUNT(*) FROM songs WHERE song_name LIKE '%\\_%\\_%\\_%\\_%' AND NOT(split_part(song_name, '_', 5)::INTEGER BETWEEN 0 AND 3)",
+        CHECK_CHEAP, True),
+]
+
+# Checks on embedded database: SQLite lacks a few PostgreSQL functions (split_part() and regular expressions are
+## provided by the tool), and has no server statistics; file integrity is checked instead
+SQLITE_QUERIES = {
+    'D0010': "SELECT COUNT(*) FROM songs s, fingerprints f WHERE f.song_id = s.song_id and MAX(s.date_created, s.date_modified, f.date_created, f.date_modified) > CURRENT_TIMESTAMP",
+    'A0050': "SELECT COUNT(*) FROM songs WHERE LENGTH(song_name) - LENGTH(replace(song_name, '_', '')) <> 4",
+    'A0051': "SELECT COUNT(*) FROM songs WHERE song_name GLOB '*_*_*_*_*' AND NOT(split_part(song_name, '_', 3) REGEXP '^\\d{2}(([0][1-9])|([1][0-2]))(([0-2][0-9])|([3][0-1]))$')",
+    'A0080': "SELECT COUNT(*) FROM songs WHERE song_name GLOB '*_*_*_*_*' AND NOT(CAST(split_part(song_name, '_', 5) AS INTEGER) BETWEEN 0 AND 3)",
+}
+SQLITE_CHECKS = [("D0090: database file integrity", "SELECT COUNT(*) FROM pragma_quick_check WHERE quick_check <> 'ok'", CHECK_EXPENSIVE, False)
+    if name.startswith('D0100') else (name, SQLITE_QUERIES.get(name[:5], query), cost, advent_only) for name, query, cost, advent_only in CHECKS]
+
+# Run one check on a connection from the pool; returns result (False or 0 if no issue), status and error if not completed,
+# and duration (s)
+def db_check(pool, query, timeout):
+    conn = pool.getconn()
+    status = None
+    error = None
     res = True
-    row = next(djv_reader)
-    if row[0] != FORMAT:
-        print(f"{song_name} (unknown format: '{row[0]}'; skipped)");
-        res = False
-    # TODO: protect conversion
-    elif int(row[1]) > FORMAT_VERSION:
-        print(f"{song_name} (unsupported version: {row[1]}; skipped)");
-        res = False
+    start_time = time.monotonic()
+    try:
+        cur = conn.cursor()
+        cur.execute("SET statement_timeout = %s", (int(timeout * 1000),))
+        start_time = time.monotonic()
+        cur.execute(query)
+        res = cur.fetchone()[0]
+    except psycopg2.extensions.QueryCanceledError:
+        status = 'TIMEOUT'
+    except psycopg2.Error as e:
+        status = 'ERROR'
+        error = str(e).strip()
+    duration = time.monotonic() - start_time
+    conn.rollback()
+    pool.putconn(conn)
+    return res, status, error, duration
+
+# Same as db_check() on embedded database. Time limit is enforced by interrupting the query
+def sqlite_check(conn, query, timeout):
+    status = None
+    error = None
+    res = True
+    start_time = time.monotonic()
+    conn.set_progress_handler(lambda: time.monotonic() - start_time > timeout, 10000)
+    try:
+        res = conn.execute(query).fetchone()[0]
+    except sqlite3.OperationalError as e:
+        if time.monotonic() - start_time > timeout:
+            status = "TIMEOUT"
+        else:
+            status = "ERROR"
+            error = str(e).strip()
+    finally:
+        conn.set_progress_handler(None, 0)
+    return res, status, error, time.monotonic() - start_time
+
+# Run checks, yielding their results in order. Server checks run in parallel
+def db_checks(conn, checks, timeout):
+    if DB_FILE != None:
+        for check in checks:
+            yield sqlite_check(conn, check[1], timeout)
+        return
+    pool = psycopg2.pool.ThreadedConnectionPool(1, CHECK_CONNECTIONS, db_dsn())
+    with concurrent.futures.ThreadPoolExecutor(max_workers=CHECK_CONNECTIONS) as executor:
+        futures = [executor.submit(db_check, pool, check[1], timeout) for check in checks]
+        for future in futures:
+            yield future.result()
+    pool.closeall()
+
+# Returns format version of a file (0 if not supported)
+def file_check(song_name, fname, log=print):
+    with open(fname, 'rb') as djv_file:
+        head = djv_file.read(DJV2_HEADER.size)
+    magic = head[:len(FORMAT)]
+    if magic != FORMAT.encode():
+        log(f"{song_name} (unknown format: '{magic.decode(errors='replace')}'; skipped)");
+        return 0
+    if head[len(FORMAT):len(FORMAT) + 1] == b',':
+        version = head.split(b'\n')[0].split(b',')[1].decode(errors='replace').strip()
+        if version != '1':
+            log(f"{song_name} (unsupported version: {version}; skipped)");
+            return 0
+        return 1
+    version = head[len(FORMAT)] if len(head) > len(FORMAT) else 0
+    if version != 2 or len(head) < DJV2_HEADER.size or head[len(FORMAT) + 1] >= len(COMPRESSIONS):
+        log(f"{song_name} (unsupported version: {version}; skipped)");
+        return 0
     # TODO: more checks
-    return res
+    return version
+
+# Hashes as an array of rows. Hashes of variable size (see health check D0040) cannot form an array; they are kept as a
+# list of rows, which only text format can store
+def hash_array(rows):
+    if len({len(row) for row in rows}) > 1:
+        return [bytes(row) for row in rows]
+    return np.frombuffer(b''.join(rows), dtype=np.uint8).reshape(len(rows), len(rows[0]) if len(rows) else 0)
+
+def hash_hexes(hashes):
+    if isinstance(hashes, list):
+        return [row.hex() for row in hashes]
+    hexes = hashes.tobytes().hex()
+    width = 2 * hashes.shape[1]
+    return [hexes[i * width:(i + 1) * width] for i in range(len(hashes))]
+
+def zstd():
+    try:
+        import zstandard
+    except ImportError:
+        sys.exit("Error: zstd compression requires 'zstandard' module (pip install zstandard)")
+    return zstandard
+
+def compress(data, compression):
+    if compression == 'gzip':
+        return gzip.compress(data)
+    if compression == 'zstd':
+        return zstd().ZstdCompressor().compress(data)
+    return data
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zstd':
+        return zstd().ZstdDecompressor().decompress(data)
+    return data
+
+# Read a file of a given version; returns track (dict), fingerprint offsets (array) and hashes (array of rows)
+def djv_read(fname, version, header_only=False):
+    if version == 1:
+        with open(fname, newline='') as djv_file:
+            djv_reader = csv.reader(djv_file)
+            next(djv_reader)
+            song = next(djv_reader)
+            track = {'song_name': song[0], 'fingerprinted': int(song[1]), 'file_sha1': song[2], 'total_hashes': int(song[3]),
+                'version': version, 'compression': 'none'}
+            if header_only:
+                return track, None, None
+            offsets = []
+            hashes = []
+            for fingerprint in djv_reader:
+                offsets.append(int(fingerprint[0]))
+                hashes.append(fingerprint[1])
+        return track, np.array(offsets, dtype='<u4'), hash_array([bytes.fromhex(hsh) for hsh in hashes])
+
+    with open(fname, 'rb') as djv_file:
+        magic, version, compression, fingerprinted, hash_size, n, total_hashes, file_sha1, name_length = DJV2_HEADER.unpack(djv_file.read(DJV2_HEADER.size))
+        track = {'song_name': djv_file.read(name_length).decode(), 'fingerprinted': fingerprinted, 'file_sha1': file_sha1.hex(),
+            'total_hashes': total_hashes, 'version': version, 'compression': COMPRESSIONS[compression]}
+        if header_only:
+            return track, None, None
+        djv_file.seek(-(DJV2_HEADER.size + name_length) % 8, os.SEEK_CUR)
+        payload = decompress(djv_file.read(), track['compression'])
+    offsets = np.frombuffer(payload, dtype='<u4', count=n)
+    return track, offsets, np.frombuffer(payload, dtype=np.uint8, count=n * hash_size, offset=offsets.nbytes).reshape(n, hash_size)
+
+def djv_write(fname, track, offsets, hashes, version=FORMAT_VERSION_EXPORT, compression='none'):
+    if version == 1:
+        with open(fname, mode='w') as djv_file:
+            djv_writer = csv.writer(djv_file)
+            djv_writer.writerow([FORMAT, version])
+            djv_writer.writerow([track['song_name'], track['fingerprinted'], track['file_sha1'], track['total_hashes']])
+            for offset, hsh in zip(offsets.tolist(), hash_hexes(hashes)):
+                djv_writer.writerow([offset, hsh])
+    else:
+        if isinstance(hashes, list):
+            raise ValueError("hashes of variable size; use format version 1")
+        name = track['song_name'].encode()
+        header = DJV2_HEADER.pack(FORMAT.encode(), version, COMPRESSIONS.index(compression), track['fingerprinted'], hashes.shape[1],
+            len(offsets), track['total_hashes'], bytes.fromhex(track['file_sha1']), len(name))
+        payload = compress(offsets.astype('<u4').tobytes() + hashes.tobytes(), compression)
+        with open(fname, mode='wb') as djv_file:
+            djv_file.write(header + name + bytes(-(len(header) + len(name)) % 8))
+            djv_file.write(payload)
+
+# Files given on command line, with folders expanded
+def file_list(paths):
+    flist = []
+    for fname in paths:
+        if os.path.isdir(fname):
+            for root, dirs, files in os.walk(fname):
+                for f in files:
+                    if f != MANIFEST:
+                        flist.append(os.path.join(root, f))
+        else:
+            flist.append(fname)
+    return flist
+
+# Manifest of a file tree: path (relative to the top), size, modification time, track name and SHA1 of every track file
+## An entry is trusted as long as file size and modification time do not change, so that sync does not have to open
+## every file to learn what it contains
+def manifest_load(root):
+    manifest = {}
+    try:
+        with open(os.path.join(root, MANIFEST), newline='') as manifest_file:
+            manifest_reader = csv.reader(manifest_file)
+            if next(manifest_reader, None) == [MANIFEST, str(MANIFEST_VERSION)]:
+                for path, size, mtime, song_name, file_sha1 in manifest_reader:
+                    manifest[path] = (int(size), int(mtime), song_name, file_sha1)
+    except (OSError, ValueError):
+        manifest = {}    # rebuilt from files
+    return manifest
+
+def manifest_save(root, manifest):
+    fname = os.path.join(root, MANIFEST)
+    try:
+        with open(fname + '.tmp', mode='w', newline='') as manifest_file:
+            manifest_writer = csv.writer(manifest_file)
+            manifest_writer.writerow([MANIFEST, MANIFEST_VERSION])
+            for path, entry in sorted(manifest.items()):
+                manifest_writer.writerow([path, *entry])
+        os.replace(fname + '.tmp', fname)
+    except OSError as e:
+        print(f"Warning: cannot save manifest: {e}")
+
+# Track files of a file tree; other files (e.g., README, or .git of an advent-db checkout) are not looked at
+def track_files(root):
+    for path, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for f in files:
+            if f.endswith('.' + FORMAT):
+                yield os.path.join(path, f)
+
+# Bring manifest of a file tree up to date; returns {path: (track name, SHA1)} of readable track files
+def manifest_scan(root, log=print):
+    manifest = manifest_load(root)
+    entries = {}
+    for path in track_files(root):
+        stat = os.stat(path)
+        path = os.path.relpath(path, root)
+        entry = manifest.get(path)
+        if entry is None or entry[:2] != (stat.st_size, stat.st_mtime_ns):
+            version = file_check(path, os.path.join(root, path), log)
+            if not(version):
+                continue
+            track = djv_read(os.path.join(root, path), version, header_only=True)[0]
+            entry = (stat.st_size, stat.st_mtime_ns, track['song_name'], track['file_sha1'])
+        entries[path] = entry
+    if entries != manifest:
+        manifest_save(root, entries)
+    return {path: entry[2:] for path, entry in entries.items()}
+
+# Tracks to export; files known to match the database are not touched. Returns tracks and number of tracks unchanged
+def export_plan(songs, make_directories, output_files):
+    manifest = manifest_scan('.')
+    changed_songs = []
+    n_unchanged = 0
+    for song in songs:
+        fname = export_fname(song['song_name'], make_directories)
+        if fname in manifest and manifest[fname][1] == song['file_sha1'].hex():
+            n_unchanged += 1
+            output_files.add(fname)
+        else:
+            changed_songs.append(song)
+    return changed_songs, n_unchanged
+
+# Align file system to the files exported, and refresh manifest if it was used
+def export_sync(output_files, sync, n_unchanged):
+    if sync:
+        files_on_disk = set()
+        for root, dirs, files in os.walk('.'):
+            for f in files:
+                if f != MANIFEST:
+                    files_on_disk.add(os.path.join(root, f)[2:])
+        extra_files = files_on_disk - output_files
+        for f in extra_files:
+            print(f"{f}: (does not exist in database; deleted on disk)")
+            os.remove(f)
+
+    if n_unchanged != None:
+        if n_unchanged:
+            print(f"Skipped {n_unchanged} unchanged tracks")
+        manifest_scan('.')
+
+# Files to import, given SHA1 of the tracks in the database. Folders are compared to the database as a whole using their
+# manifests, and files known to match the database are not touched. Returns files to import, names of tracks found in
+# folders and number of files unchanged
+def import_plan(paths, database_sha1, overwrite, overwrite_always):
+    flist = []
+    input_files = set()
+    n_unchanged = 0
+    for fname in paths:
+        if os.path.isdir(fname):
+            for path, (song_name, file_sha1) in manifest_scan(fname).items():
+                input_files.add(song_name)
+                if song_name in database_sha1 and not overwrite_always and (not overwrite or database_sha1[song_name] == file_sha1):
+                    n_unchanged += 1
+                else:
+                    flist.append(os.path.join(fname, path))
+        else:
+            flist.append(fname)
+    return flist, input_files, n_unchanged
+
+def db_dsn():
+    return f"host={DB_HOST} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}"
+
+def db_connect():
+    if DB_FILE != None:
+        return sqlite_connect(DB_FILE)
+    return psycopg2.connect(db_dsn())
+
+# Connection of its own for statements which cannot run inside a transaction block (VACUUM and the like). The main
+## connection cannot be switched to autocommit for these: within "with conn:" psycopg2 (2.9+) opens a transaction anyway
+def db_autocommit_connect():
+    conn = psycopg2.connect(db_dsn())
+    conn.autocommit = True
+    return conn
+
+# Embedded database
+## The SQLite file AdVent uses with "-D FILE", holding the same tables as PostgreSQL. Commands go the same way on both
+## databases; helpers below take care of the differences. Parallel jobs, statistics table and server tuning do not apply,
+## as the database is local and small
+def sqlite_connect(database):
+    from advent.SQLiteDatabase import SQLiteDatabase   # needs Dejavu, unlike the rest of this tool
+    db = SQLiteDatabase(database)
+    db.createTables()
+    db.conn.row_factory = sqlite3.Row
+    db.conn.create_function('split_part', 3, split_part, deterministic=True)
+    db.conn.create_function('regexp', 2, regexp, deterministic=True)
+    return db.conn
+
+# PostgreSQL functions used by checks
+def split_part(string, delimiter, n):
+    parts = string.split(delimiter)
+    return parts[n - 1] if n <= len(parts) else ''
+
+def regexp(pattern, string):
+    return string is not None and re.search(pattern, string) is not None
+
+# Run a query on either database; returns the cursor. Queries use PostgreSQL parameter style
+def db_execute(conn, query, params=()):
+    if DB_FILE != None:
+        return conn.execute(query.replace('%s', '?'), params)
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute(query, params)
+    return cur
+
+# Condition on track name for a simple pattern (*, ?), and its parameter
+def db_name_match(pattern):
+    if DB_FILE != None:
+        return "song_name GLOB %s", pattern
+    return "song_name LIKE %s", pattern.translate({42: 37, 63: 95})
+
+# Tracks matching a pattern, sorted by name
+def db_songs(conn, pattern):
+    condition, param = db_name_match(pattern)
+    songs = []
+    for song in db_execute(conn, f"SELECT * FROM songs WHERE {condition} ORDER BY song_name", (param,)):
+        song = dict(song)
+        song['file_sha1'] = bytes(song['file_sha1'])
+        songs.append(song)
+    conn.commit()
+    return songs
+
+# Parallel jobs
+## Every worker process has its own database connection. Results come back to the main process, which alone prints and
+## updates the progress bar
+WORKER_CONN = None
+
+def init_worker():
+    global WORKER_CONN
+    WORKER_CONN = db_connect()
+
+def run_worker_job(func, job):
+    return list(func(WORKER_CONN, *job))
+
+# Split items into jobs; a few jobs per worker evens out the load
+def split_jobs(items, n_workers):
+    if n_workers <= 1:
+        return [items]
+    n_jobs = min(len(items), n_workers * JOBS_PER_WORKER)
+    return [items[i::n_jobs] for i in range(n_jobs)]
+
+# Run generator func(conn, *job) for every job, yielding its results. With workers, results of a job come when it completes
+def run_jobs(func, jobs, n_workers, conn):
+    if n_workers <= 1:
+        for job in jobs:
+            yield from func(conn, *job)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=n_workers, initializer=init_worker) as executor:
+            futures = [executor.submit(run_worker_job, func, job) for job in jobs]
+            for future in concurrent.futures.as_completed(futures):
+                yield from future.result()
+
+# Rename a track file; returns whether renamed. Progress goes on the line started by the caller
+def file_rename(name1, name2, overwrite, overwrite_always):
+    do_rename = True
+    if os.path.exists(name1):
+        if os.path.exists(name2) and not(overwrite_always):
+            if overwrite:
+
+                file1_sha1 = None
+                file2_sha1 = None
+
+                version = file_check(name1, name1)
+                if version:
+                    file1_sha1 = djv_read(name1, version, header_only=True)[0]['file_sha1']
+
+                version = file_check(name2, name2)
+                if version:
+                    file2_sha1 = djv_read(name2, version, header_only=True)[0]['file_sha1']
+
+                if file1_sha1 == file2_sha1:
+                    print(" (target exists and checksum matches; skipped)")
+                    do_rename = False
+            else:
+                print(" (target exists; skipped)")
+                do_rename = False
+
+        if do_rename:
+            version = file_check(name1, name1)
+            if version:
+                track, offsets, hashes = djv_read(name1, version)
+                track['song_name'] = name2[:-len('.' + FORMAT)]
+                djv_write(name2, track, offsets, hashes, version, track['compression'])
+                print(f": {name2}")
+            else:
+                do_rename = False
 
+            if do_rename:
+                os.remove(name1)
+    else:
+        print(" (file not found)")
+        do_rename = False
+    return do_rename
+
+# Target file of a track; returns file name and messages (non-empty if the track is to be skipped)
+def export_fname(song_name, make_directories):
+    if make_directories:
+        return 'DB/' + '/'.join(song_name.split('_')[:2]) + '/' + song_name + "." + FORMAT   # First two fields
+    return song_name + "." + FORMAT
+
+def export_target(song, make_directories, overwrite, overwrite_always):
+    messages = []
+    fname = export_fname(song['song_name'], make_directories)
+    if make_directories:
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+    if os.path.exists(fname) and not overwrite_always:
+        if overwrite:
+            version = file_check(song['song_name'], fname, messages.append)
+            if not(version):
+                return fname, messages
+
+            track = djv_read(fname, version, header_only=True)[0]
+            if track['file_sha1'] == song['file_sha1'].hex():
+                messages.append(f"{song['song_name']} (exists and checksum matches; skipped)")
+        else:
+            messages.append(f"{song['song_name']} (exists; skipped)")
+    return fname, messages
+
+# Export tracks into files; yields file name and messages per track
+## Fingerprints of all tracks come in one ordered scan through a server-side cursor and are split into files as song_id
+## changes, so memory use does not depend on the size of the export
+def export_songs(conn, songs, make_directories, overwrite, overwrite_always, version=FORMAT_VERSION_EXPORT, compression='none'):
+    targets, skipped = export_targets(songs, make_directories, overwrite, overwrite_always)
+    yield from skipped
+    if not len(targets):
+        return
+
+    song_ids = [song['song_id'] for song, fname in targets]
+    if DB_FILE != None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS export_songs (song_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM export_songs")
+        conn.executemany("INSERT INTO export_songs (song_id) VALUES (?)", [(song_id,) for song_id in song_ids])
+        cur = conn.execute('SELECT song_id, "offset", hash FROM fingerprints WHERE song_id IN (SELECT song_id FROM export_songs) ORDER BY song_id, "offset", hash')
+    else:
+        cur = conn.cursor('export')
+        cur.itersize = EXPORT_FETCH_SIZE
+        cur.execute('SELECT song_id, "offset", hash FROM fingerprints WHERE song_id = ANY(%s) ORDER BY song_id, "offset", hash', (song_ids,))
+    yield from export_stream(targets, cur, version, compression)
+    cur.close()
+    conn.commit()
+
+# Split tracks into targets sorted by track id and skipped tracks with their messages
+def export_targets(songs, make_directories, overwrite, overwrite_always):
+    targets = []
+    skipped = []
+    for song in songs:
+        fname, messages = export_target(song, make_directories, overwrite, overwrite_always)
+        if len(messages):
+            skipped.append((fname, messages))
+        else:
+            targets.append((song, fname))
+    targets.sort(key=lambda target: target[0]['song_id'])
+    return targets, skipped
+
+# Write target files from fingerprint rows (song_id, offset, hash) ordered by track id
+def export_stream(targets, rows, version, compression):
+    fingerprints = iter(rows)
+    fingerprint = next(fingerprints, None)
+    for song, fname in targets:
+        offsets = []
+        hashes = []
+        while fingerprint is not None and fingerprint[0] < song['song_id']:
+            fingerprint = next(fingerprints, None)
+        while fingerprint is not None and fingerprint[0] == song['song_id']:
+            offsets.append(fingerprint[1])
+            hashes.append(bytes(fingerprint[2]))
+            fingerprint = next(fingerprints, None)
+        track = {'song_name': song['song_name'], 'fingerprinted': song['fingerprinted'], 'file_sha1': song['file_sha1'].hex(),
+            'total_hashes': song['total_hashes']}
+        try:
+            djv_write(fname, track, np.array(offsets, dtype='<u4'), hash_array(hashes), version, compression)
+        except ValueError as e:
+            yield fname, [f"{song['song_name']} ({e}; skipped)"]
+            continue
+        yield fname, [f"{song['song_name']}: {fname}"]
+
+# Header of a file to import; returns format version (0 if file is not readable) and track
+def import_header(f, messages):
+    if not os.path.exists(f):
+        messages.append(f"{f} (file not found)")
+        return 0, None
+    version = file_check(f, f, messages.append)
+    if not(version):
+        return 0, None
+    return version, djv_read(f, version, header_only=True)[0]
+
+# Import one file in one transaction; returns track name (None if file is not readable), number of fingerprints
+# imported (None if skipped) and messages
+def import_file(conn, f, overwrite, overwrite_always):
+    messages = []
+    version, track = import_header(f, messages)
+    if not(version):
+        return None, None, messages
+    song_name = track['song_name']
+    file_sha1 = track['file_sha1']
+
+    song = db_execute(conn, "SELECT file_sha1 FROM songs WHERE song_name = %s", (song_name,)).fetchone()
+    conn.commit()
+    if song != None:
+        if overwrite_always or overwrite and file_sha1 != bytes(song['file_sha1']).hex():
+            db_delete_songs(conn, "song_name = %s", (song_name,))
+        else:
+            if overwrite:
+                messages.append(f"{song_name} (exists and checksum matches; skipped)")
+            else:
+                messages.append(f"{song_name} (exists; skipped)")
+            return song_name, None, messages
+
+    track, offsets, hashes = djv_read(f, version)
+    db_insert_song(conn, track, offsets, hashes)
+    conn.commit()
+    messages.append(song_name)
+    return song_name, len(offsets), messages
+
+# Insert a track with its fingerprints, as part of the current transaction
+def db_insert_song(conn, track, offsets, hashes):
+    song = (track['song_name'], track['fingerprinted'], bytes.fromhex(track['file_sha1']), track['total_hashes'])
+    if DB_FILE != None:
+        song_id = conn.execute("INSERT INTO songs (song_name, fingerprinted, file_sha1, total_hashes) VALUES (?, ?, ?, ?)", song).lastrowid
+        conn.executemany('INSERT INTO fingerprints (song_id, "offset", hash) VALUES (?, ?, ?)',
+            ((song_id, offset, bytes(hsh)) for offset, hsh in zip(offsets.tolist(), hashes)))
+        return
+
+    cur = conn.cursor()
+    cur.execute("INSERT INTO songs (song_name, fingerprinted, file_sha1, total_hashes) VALUES (%s, %s, %s, %s) RETURNING song_id", song)
+    song_id = int(cur.fetchone()[0])
+
+    # Fingerprints go in bulk
+    copy_data = io.StringIO()
+    for offset, hsh in zip(offsets.tolist(), hash_hexes(hashes)):
+        copy_data.write(f"{song_id}\t{offset}\t\\\\x{hsh}\n")
+    copy_data.seek(0)
+    cur.copy_expert("COPY fingerprints (song_id, \"offset\", hash) FROM STDIN", copy_data)
+    db_stats_update(cur, song_id)
+    cur.close()
+
+def import_files(conn, flist, overwrite, overwrite_always):
+    for f in flist:
+        yield import_file(conn, f, overwrite, overwrite_always)
+
+# Statistics
+## Per-track figures are kept in a table of their own, so that dbinfo does not have to scan all fingerprints. Rows are
+## added on import and removed together with their track; tracks added or changed by other means (e.g., being
+## fingerprinted by Dejavu) are accounted for on next dbinfo. There is no foreign key to songs, which would get in the way
+## of Dejavu dropping its tables; a row is current as long as song_id, creation and modification dates and fingerprinted
+## flag of the track match. Hash collisions cannot be counted per track and are only refreshed with --recompute
+STATS_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS djv_song_stats (song_id INTEGER PRIMARY KEY, song_date TIMESTAMP NOT NULL, "
+        "peak_groups BIGINT NOT NULL, fingerprints BIGINT NOT NULL, max_offset INTEGER, min_hash_size INTEGER, max_hash_size INTEGER, "
+        "first_update TIMESTAMP, last_update TIMESTAMP, song_fingerprinted INTEGER, song_modified TIMESTAMP)",
+    # Tables created by earlier versions; their rows get refreshed on next dbinfo
+    "ALTER TABLE djv_song_stats ADD COLUMN IF NOT EXISTS song_fingerprinted INTEGER, ADD COLUMN IF NOT EXISTS song_modified TIMESTAMP",
+    "CREATE TABLE IF NOT EXISTS djv_stats (name TEXT PRIMARY KEY, value BIGINT NOT NULL, date_computed TIMESTAMP NOT NULL DEFAULT now())",
+]
+STATS_COLUMNS = "(song_id, song_date, peak_groups, fingerprints, max_offset, min_hash_size, max_hash_size, first_update, last_update, song_fingerprinted, song_modified)"
+
+## Dates only count for tracks having fingerprints, as they always did
+STATS_QUERY = """SELECT s.song_id, s.date_created, COUNT(DISTINCT f."offset"), COUNT(f.hash), MAX(f."offset"), MIN(LENGTH(f.hash)), MAX(LENGTH(f.hash)),
+    CASE WHEN COUNT(f.hash) <> 0 THEN LEAST(s.date_created, s.date_modified, MIN(f.date_created), MIN(f.date_modified)) END,
+    CASE WHEN COUNT(f.hash) <> 0 THEN GREATEST(s.date_created, s.date_modified, MAX(f.date_created), MAX(f.date_modified)) END,
+    s.fingerprinted, s.date_modified
+    FROM songs s LEFT JOIN fingerprints f ON f.song_id = s.song_id WHERE {} GROUP BY s.song_id"""
+
+def db_stats_init(cursor):
+    for query in STATS_SCHEMA:
+        cursor.execute(query)
+
+# Add statistics of a track, or bring them up to date for all tracks
+def db_stats_update(cursor, song_id=None):
+    if song_id != None:
+        cursor.execute("DELETE FROM djv_song_stats WHERE song_id = %s", (song_id,))
+        cursor.execute("INSERT INTO djv_song_stats " + STATS_COLUMNS + " " + STATS_QUERY.format("s.song_id = %s"), (song_id,))
+    else:
+        cursor.execute("DELETE FROM djv_song_stats st WHERE NOT EXISTS (SELECT 1 FROM songs s WHERE s.song_id = st.song_id AND s.date_created = st.song_date "
+            "AND s.fingerprinted = st.song_fingerprinted AND s.date_modified = st.song_modified)")
+        cursor.execute("INSERT INTO djv_song_stats " + STATS_COLUMNS + " " + STATS_QUERY.format("NOT EXISTS (SELECT 1 FROM djv_song_stats st WHERE st.song_id = s.song_id)"))
+
+# Delete tracks matching a condition together with their statistics (fingerprints go by cascade), as part of the current
+# transaction; returns names of tracks deleted
+def db_delete_songs(conn, condition, params):
+    if DB_FILE != None:
+        songs = [song[0] for song in db_execute(conn, f"SELECT song_name FROM songs WHERE {condition}", params)]
+        db_execute(conn, f"DELETE FROM songs WHERE {condition}", params)
+        return songs
+    cur = db_execute(conn, f"WITH deleted AS (DELETE FROM songs WHERE {condition} RETURNING song_id, song_name), "
+        "stats AS (DELETE FROM djv_song_stats st USING deleted WHERE st.song_id = deleted.song_id) SELECT song_name FROM deleted", params)
+    songs = [song[0] for song in cur.fetchall()]
+    cur.close()
+    return songs
+
+# Recompute all statistics in one pass over fingerprints
+def db_stats_recompute(cursor):
+    cursor.execute("DELETE FROM djv_song_stats")
+    cursor.execute("""WITH f AS (SELECT song_id, COUNT(DISTINCT "offset") AS peak_groups, COUNT(*) AS fingerprints, MAX("offset") AS max_offset,
+            MIN(LENGTH(hash)) AS min_hash_size, MAX(LENGTH(hash)) AS max_hash_size, LEAST(MIN(date_created), MIN(date_modified)) AS first_update,
+            GREATEST(MAX(date_created), MAX(date_modified)) AS last_update, COUNT(DISTINCT hash) AS distinct_hashes
+            FROM fingerprints GROUP BY GROUPING SETS ((song_id), ())),
+        song_stats AS (INSERT INTO djv_song_stats """ + STATS_COLUMNS + """ SELECT s.song_id, s.date_created, COALESCE(f.peak_groups, 0),
+            COALESCE(f.fingerprints, 0), f.max_offset, f.min_hash_size, f.max_hash_size,
+            CASE WHEN f.fingerprints <> 0 THEN LEAST(s.date_created, s.date_modified, f.first_update) END,
+            CASE WHEN f.fingerprints <> 0 THEN GREATEST(s.date_created, s.date_modified, f.last_update) END, s.fingerprinted, s.date_modified
+            FROM songs s LEFT JOIN f ON f.song_id = s.song_id)
+        SELECT fingerprints, distinct_hashes FROM f WHERE song_id IS NULL""")
+    totals = cursor.fetchone()
+    cursor.execute("INSERT INTO djv_stats (name, value) VALUES ('fingerprints', %s), ('distinct_hashes', %s) "
+        "ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, date_computed = EXCLUDED.date_computed", (totals[0], totals[1]))
+
+# Secondary (non-constraint) indexes of a table, as (name, definition)
+def db_indexes(cursor, table):
+    cursor.execute("SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE t.relname = %s AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)", (table,))
+    return cursor.fetchall()
+
+def print_timing(title, count, unit, seconds):
+    print(f"{title}: {count} {unit} in {round(seconds, 1)} s" + (f" ({round(count / seconds)} {unit}/s)" if seconds > 0 and count else ""))
+
+def print_import_summary(n_files, n_imported, n_fingerprints, n_unchanged, seconds):
+    print_timing("Imported", n_imported, "tracks", seconds)
+    print_timing("Imported", n_fingerprints, "fingerprints", seconds)
+    if n_unchanged:
+        print(f"Skipped {n_unchanged} unchanged files")
+    if n_files != n_imported:
+        print(f"Skipped {n_files - n_imported} files")
+
+# Vacuum and analyze all tables
 def db_vacuum(conn, full=False):
-    with alive_bar(title='Vacuuming', receipt=False) as bar:
-        query = "VACUUM"
-        if full:
-            query += " FULL"
-        autocommit = conn.autocommit
-        conn.autocommit = True   # VACUUM cannot run inside a transaction block
-        cur = conn.cursor()
-        cur.execute(query)
-        if not(full):
-            cur.execute(query)   # No idea why, but sometimes VACUUM has to be run twice to take effect
-        conn.autocommit = autocommit
+    if DB_FILE != None:
+        with alive_bar(title='Vacuuming', receipt=False) as bar:
+            conn.execute("VACUUM")    # always rebuilds the file
+            conn.execute("ANALYZE")
+        return
+    vacuum_conn = db_autocommit_connect()
+    try:
+        cur = vacuum_conn.cursor()
+        cur.execute("SELECT relname FROM pg_stat_user_tables WHERE relname = ANY(%s)", (MAINTENANCE_TABLES,))
+        tables = [table[0] for table in cur]
+        with alive_bar(title='Vacuuming', receipt=False) as bar:
+            query = "VACUUM (FULL, ANALYZE) {}" if full else "VACUUM (ANALYZE) {}"
+            for table in tables:
+                cur.execute(sql.SQL(query).format(sql.Identifier(table)))
+        cur.close()
+    finally:
+        vacuum_conn.close()
+
+# Maintenance after changes
+## Only tables changed enough since their last vacuum (or analyze) are processed, once. Server statistics might not yet
+## account for the very last changes; these are picked up by the next pass (or by autovacuum)
+def db_maintain(conn):
+    if DB_FILE != None:
+        conn.execute("PRAGMA optimize")    # analyzes tables where needed
+        return
+    vacuum_conn = db_autocommit_connect()
+    try:
+        cur = vacuum_conn.cursor()
+        cur.execute(f"SELECT relname, {VACUUM_NEEDED}, {ANALYZE_NEEDED} FROM pg_stat_user_tables t WHERE relname = ANY(%s)", (MAINTENANCE_TABLES,))
+        tables = [(table[0], "VACUUM (ANALYZE) {}" if table[1] else "ANALYZE {}") for table in cur if table[1] or table[2]]
+        if len(tables):
+            with alive_bar(title='Vacuuming', receipt=False) as bar:
+                for table, query in tables:
+                    cur.execute(sql.SQL(query).format(sql.Identifier(table)))
+        cur.close()
+    finally:
+        vacuum_conn.close()
+
+# Recognition lookup benchmark
+## Batches of hashes are taken from random tracks, and looked up the way Dejavu does
+def db_bench_batches(cursor, n_batches=BENCH_LOOKUPS, batch_size=BENCH_BATCH):
+    cursor.execute("SELECT song_id FROM songs WHERE total_hashes > 0")
+    song_ids = [song[0] for song in cursor]
+    batches = []
+    for song_id in random.choices(song_ids, k=n_batches) if len(song_ids) else []:
+        cursor.execute("SELECT hash FROM fingerprints WHERE song_id = %s ORDER BY random() LIMIT %s", (song_id, batch_size))
+        batch = tuple(bytes(fingerprint[0]) for fingerprint in cursor)
+        if len(batch):
+            batches.append(batch)
+    return batches
+
+# Returns lookup latencies (s) at 50th and 99th percentiles. A first unmeasured pass warms up caches, so that runs
+# before and after optimization compare
+def db_bench(cursor, batches):
+    latencies = []
+    for batch in batches + batches:
+        start_time = time.monotonic()
+        cursor.execute("SELECT upper(encode(hash, 'hex')), song_id, \"offset\" FROM fingerprints WHERE hash IN %s", (batch,))
+        cursor.fetchall()
+        latencies.append(time.monotonic() - start_time)
+    latencies = latencies[len(batches):]
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+def print_bench(title, latencies):
+    print(f"  {title:8}p50 = {latencies[0] * 1000:.1f} ms, p99 = {latencies[1] * 1000:.1f} ms")
+
+# Build covering index for hash lookups (if not there yet), optionally cluster the table along it, and refresh statistics.
+## Concurrent index build, CLUSTER and VACUUM cannot run inside a transaction block, so they go through a connection of their own
+def db_optimize(cluster=False):
+    optimize_conn = db_autocommit_connect()
+    try:
+        cur = optimize_conn.cursor()
+        cur.execute("SELECT x.indisvalid FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid WHERE i.relname = %s", (LOOKUP_INDEX,))
+        index = cur.fetchone()
+        if index != None and not(index[0]):
+            print(f"Index {LOOKUP_INDEX} is invalid (interrupted build?); rebuilding")
+            cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(LOOKUP_INDEX)))
+            index = None
+        if index == None:
+
+            # Built concurrently, so that AdVent can keep running; INCLUDE needs PostgreSQL 11
+            columns = "(hash) INCLUDE (song_id, \"offset\")" if optimize_conn.server_version >= 110000 else "(hash, song_id, \"offset\")"
+            with alive_bar(title='Building index', receipt=False) as bar:
+                cur.execute(sql.SQL("CREATE INDEX CONCURRENTLY {} ON fingerprints " + columns).format(sql.Identifier(LOOKUP_INDEX)))
+            print(f"Index {LOOKUP_INDEX}: created")
+        else:
+            print(f"Index {LOOKUP_INDEX}: OK")
+        if cluster:
+            with alive_bar(title='Clustering', receipt=False) as bar:
+                cur.execute(sql.SQL("CLUSTER fingerprints USING {}").format(sql.Identifier(LOOKUP_INDEX)))
+            print("Table fingerprints: clustered")
+
+        # Index-only scans also need an up to date visibility map
+        with alive_bar(title='Analyzing', receipt=False) as bar:
+            cur.execute("VACUUM (ANALYZE) fingerprints")
+        print("Table fingerprints: statistics refreshed")
+        cur.close()
+    finally:
+        optimize_conn.close()
+
+# Database figures for dbinfo. Server statistics come from the statistics table (computed on the fly without write
+# access); embedded database is small enough to compute them on every run
+def db_info(conn, recompute=False):
+    if DB_FILE != None:
+        with alive_bar(title='Computing statistics', receipt=False) as bar:
+            info = dict(conn.execute("SELECT COUNT(song_id) AS n_tracks, COALESCE(SUM(fingerprinted), 0) AS n_ftracks FROM songs").fetchone())
+            info.update(conn.execute('SELECT COALESCE(SUM(peak_groups), 0) AS peak_groups, COALESCE(SUM(fingerprints), 0) AS n_hashes, '
+                'CAST(COALESCE(ROUND(SUM(max_offset) * ? * (1 - ?) / ?), 0) AS INTEGER) AS times, MIN(min_hash_size) AS min, MAX(max_hash_size) AS max, '
+                'MIN(first_update) AS first_update, MAX(last_update) AS last_update FROM (SELECT COUNT(DISTINCT "offset") AS peak_groups, '
+                'COUNT(*) AS fingerprints, MAX("offset") AS max_offset, MIN(LENGTH(hash)) AS min_hash_size, MAX(LENGTH(hash)) AS max_hash_size, '
+                'MIN(date_created) AS first_update, MAX(date_modified) AS last_update FROM fingerprints GROUP BY song_id)',
+                (DEFAULT_WINDOW_SIZE, DEFAULT_OVERLAP_RATIO, DEFAULT_FS)).fetchone())
+            info['collisions'] = None
+            if recompute:
+                info['collisions'] = dict(conn.execute("SELECT COUNT(*) AS n_hashes, COUNT(DISTINCT hash) AS n_distinct, "
+                    "datetime('now') AS date_computed FROM fingerprints").fetchone())
+        info['size'] = os.path.getsize(DB_FILE)
+        info['size_pretty'] = f"{round(info['size'] / 1024 / 1024, 1)} MB"
+        info['last_vacuum'] = None
+        return info
+
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    stats_table = "djv_song_stats"
+    try:
+        db_stats_init(cur)
+        if recompute:
+            with alive_bar(title='Computing statistics', receipt=False) as bar:
+                db_stats_recompute(cur)
+        else:
+            db_stats_update(cur)
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Warning: statistics table not updated ({str(e).strip()}); computing statistics on the fly", file=sys.stderr)
+        stats_table = f"({STATS_QUERY.format('TRUE')}) AS st {STATS_COLUMNS}"
+
+    cur.execute("SELECT COUNT(song_id) AS n_tracks, COALESCE(SUM(fingerprinted), 0) AS n_ftracks FROM songs")
+    info = dict(cur.fetchone())
+    cur.execute("SELECT COALESCE(SUM(peak_groups), 0) AS peak_groups, COALESCE(SUM(fingerprints), 0) AS n_hashes, "
+        "COALESCE(ROUND(SUM(max_offset) * %s * (1 - %s) / %s), 0) AS times, MIN(min_hash_size) AS min, MAX(max_hash_size) AS max, "
+        "date_trunc('second', MIN(first_update)) AS first_update, date_trunc('second', MAX(last_update)) AS last_update FROM " + stats_table,
+        (DEFAULT_WINDOW_SIZE, DEFAULT_OVERLAP_RATIO, DEFAULT_FS))
+    info.update(cur.fetchone())
+    cur.execute("SELECT pg_database_size(%s) AS size, pg_size_pretty(pg_database_size(%s)) AS size_pretty", (DB_NAME, DB_NAME))
+    info.update(cur.fetchone())
+
+    info['collisions'] = None
+    cur.execute("SELECT to_regclass('djv_stats') IS NOT NULL")
+    if cur.fetchone()[0]:
+        cur.execute("SELECT MAX(CASE WHEN name = 'fingerprints' THEN value END) AS n_hashes, MAX(CASE WHEN name = 'distinct_hashes' THEN value END) AS n_distinct, "
+            "date_trunc('second', MAX(date_computed)) AS date_computed FROM djv_stats")
+        info['collisions'] = dict(cur.fetchone())
+
+    cur.execute("SELECT date_trunc('second', GREATEST(last_vacuum, last_autovacuum)::TIMESTAMP) FROM pg_stat_user_tables WHERE relname = 'fingerprints'")
+    last_vacuum = cur.fetchone()
+    info['last_vacuum'] = last_vacuum[0] if last_vacuum != None else None
+    conn.commit()
+    cur.close()
+    return info
+
+# AdVent figures, from track names in the form COUNTRY_CHANNEL_DATE_NAME_FLAGS
+def advent_info(conn):
+    tracks = [(song[0].split('_'), song[1]) for song in db_execute(conn, "SELECT song_name, fingerprinted FROM songs")]
+    conn.commit()
+    tracks = [(fields, fingerprinted) for fields, fingerprinted in tracks if len(fields) >= 5]
+    countries = len({fields[0] for fields, fingerprinted in tracks})
+    channels = len({tuple(fields[:2]) for fields, fingerprinted in tracks})
+    jingles = sum(fingerprinted for fields, fingerprinted in tracks)
+    flags = [fields[4] for fields, fingerprinted in tracks]
+    flag_bits = [int(flag) if flag.isdigit() else 0 for flag in flags]
+    dates = sorted(fields[2] for fields, fingerprinted in tracks)
+
+    print("\nAdVent database info:")
+    print(f"  Countries                    = {countries}")
+    print(f"  TV channels                  = {channels}" + (f" (avg. ~= {round(channels / countries)} per country)" if countries != 0 else ""))
+    print(f"  Jingles                      = {jingles}" + (f" (avg. ~= {round(jingles / channels)} per TV channel)" if channels != 0 else ""))
+    print(f"  Pure entry / entry jingles   = {flags.count('1')} / {sum(flag & 1 for flag in flag_bits)}")
+    print(f"  Pure exit / exit jingles     = {flags.count('2')} / {sum(bool(flag & 2) for flag in flag_bits)}")
+    print(f"  No action jingles            = {sum(1 for flag in flag_bits if flag & 3 == 0)}")
+    for title, date in ("from", dates[0] if len(dates) else None), ("till", dates[-1] if len(dates) else None):
+        print(f"  Time coverage {title}           = " + (f"20{date[0:2]}-{date[2:4]}-{date[4:6]}" if date != None else "n/a"))
 
 
 def main():
@@ -77,35 +975,103 @@ def main():
     overwrite_group.add_argument('-o', '--overwrite', action='store_true', help='overwrite existing tracks if checksums differ');
     overwrite_group.add_argument('-O', '--overwrite-always', action='store_true', help='overwrite existing tracks unconditionally');
 
+    parser_jobs = argparse.ArgumentParser(add_help=False)
+    parser_jobs.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='process files in N parallel workers, each with its own database connection (default: 1)')
+
     parser = argparse.ArgumentParser(description='Process Dejavu tracks in PGSQL database',
         epilog='Use "COMMAND -h" to get command-specific help')
+    parser.add_argument('-D', '--database', metavar='FILE', help='use an embedded database file (SQLite) instead of the database server')
+    parser.add_argument('-N', '--no-vacuum', action='store_true', help='skip maintenance after changes (for a series of commands; run "vacuum" at the end)')
     subparsers = parser.add_subparsers(dest='cmd', required=True, metavar='COMMAND')
     parser_list   = subparsers.add_parser('list', help='list tracks')
-    parser_export = subparsers.add_parser('export', parents=[parser_overwrite], help='export tracks')
-    parser_import = subparsers.add_parser('import', parents=[parser_overwrite], help='import tracks')
+    parser_export = subparsers.add_parser('export', parents=[parser_overwrite, parser_jobs], help='export tracks')
+    parser_import = subparsers.add_parser('import', parents=[parser_overwrite, parser_jobs], help='import tracks')
     parser_rename = subparsers.add_parser('rename', parents=[parser_overwrite], help='rename a track', epilog=f'Names ending with .{FORMAT} will result in file operation, otherwise rename will be done in the database')
+    parser_convert = subparsers.add_parser('convert', help='convert track files to another format version')
     parser_delete = subparsers.add_parser('delete', help='delete tracks')
     parser_dbinfo = subparsers.add_parser('dbinfo', help='show database info')
     parser_vacuum = subparsers.add_parser('vacuum', help='vacuum the database (improves performance)')
+    parser_optimize = subparsers.add_parser('optimize', help='tune the database for recognition lookups and benchmark them')
 
     parser_list.add_argument  ('filter', help='filter name using simple pattern matching (*, ?; default: * == all)', nargs='?', default='*')
     parser_export.add_argument('filter', help='filter name using simple pattern matching (*, ?; default: * == all)', nargs='?', default='*')
     parser_export.add_argument('-d', '--make-directories', action='store_true', help='split files in folders according to file prefix')
     parser_export.add_argument('-s', '--sync', action='store_true', help='align file system content to database (implies \'-o\')')
+    parser_export.add_argument('-F', '--format-version', type=int, choices=range(1, FORMAT_VERSION + 1), default=FORMAT_VERSION_EXPORT, help=f'file format version (1 - text, 2 - binary; default: {FORMAT_VERSION_EXPORT})')
+    parser_export.add_argument('-z', '--compression', choices=COMPRESSIONS, default='none', help='compression of binary files (default: none)')
     parser_import.add_argument('filter', metavar='FILE', help='.' + FORMAT + ' file to import', nargs='+')
     parser_import.add_argument('-s', '--sync', action='store_true', help='align database content to file system (implies \'-o\')')
+    parser_import.add_argument('-R', '--rebuild-indexes', action='store_true', help='drop secondary fingerprint indexes during import and rebuild them at the end (faster for full reloads)')
+    parser_convert.add_argument('filter', metavar='FILE', help='.' + FORMAT + ' file or folder to convert', nargs='+')
+    parser_convert.add_argument('-F', '--format-version', type=int, choices=range(1, FORMAT_VERSION + 1), default=FORMAT_VERSION, help=f'target file format version (1 - text, 2 - binary; default: {FORMAT_VERSION})')
+    parser_convert.add_argument('-z', '--compression', choices=COMPRESSIONS, default='none', help='compression of binary files (default: none)')
     parser_rename.add_argument('name1', help='original track name')
     parser_rename.add_argument('name2', help='new track name')
     # NB: technically, "?" does not mean "none" but all tracks with one char name, but normally we should not have any
     parser_delete.add_argument('filter', help='filter name using simple pattern matching (*, ?; default: ? == none)', nargs='?', default='?')
-    parser_dbinfo.add_argument('-c', '--check', action='store_true', help='check database consistency');
+    check_group = parser_dbinfo.add_mutually_exclusive_group()
+    check_group.add_argument('-c', '--check', action='store_true', help='check database consistency (cheap checks only)');
+    check_group.add_argument('-C', '--check-all', action='store_true', help='check database consistency, including checks scanning all fingerprints');
+    parser_dbinfo.add_argument('-t', '--timeout', metavar='SECONDS', type=float, default=CHECK_TIMEOUT, help=f'time limit of every check (default: {CHECK_TIMEOUT})');
+    parser_dbinfo.add_argument('-r', '--recompute', action='store_true', help='recompute statistics from scratch (scans all fingerprints)');
     parser_vacuum.add_argument('-f', '--full', action='store_true', help='perform a full vacuum (requires stopping AdVent)');
+    parser_optimize.add_argument('-c', '--cluster', action='store_true', help='also reorder fingerprints along hashes (requires stopping AdVent)');
+    parser_optimize.add_argument('-b', '--benchmark-only', action='store_true', help='only run the lookup benchmark');
     args = parser.parse_args()
+    if args.cmd in ('export', 'convert') and args.format_version == 1 and args.compression != 'none':
+        parser.error("compression requires binary format (-F 2)")
+
+    # File-only operation; no database needed
+    if args.cmd == 'convert':
+        n_converted = 0
+        size_in = 0
+        size_out = 0
+        for f in file_list(args.filter):
+            if not os.path.exists(f):
+                print(f"{f} (file not found)")
+                RETURN_CODE = 1
+                continue
+            version = file_check(f, f)
+            if not(version):
+                RETURN_CODE = 1
+                continue
+            track, offsets, hashes = djv_read(f, version)
+            if version == args.format_version and track['compression'] == args.compression:
+                print(f"{f} (already in target format; skipped)")
+                continue
+            size = os.path.getsize(f)
+            try:
+                djv_write(f + '.tmp', track, offsets, hashes, args.format_version, args.compression)
+            except ValueError as e:
+                print(f"{f} ({e}; skipped)")
+                RETURN_CODE = 1
+                continue
+            os.replace(f + '.tmp', f)
+            size_in += size
+            size_out += os.path.getsize(f)
+            n_converted += 1
+            print(f"{f}: v{version} ({track['compression']}) -> v{args.format_version} ({args.compression})")
+        print(f"Converted {n_converted} files" + (f" ({size_in} -> {size_out} bytes)" if n_converted else ""))
+        return RETURN_CODE
 
-    conn = psycopg2.connect(f"host={DB_HOST} dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD}")
+    # Embedded database
+    if args.database != None:
+        global DB_FILE
+        DB_FILE = args.database
+        if not os.path.isfile(DB_FILE) and args.cmd != 'import':   # import creates a new database
+            print(f"Error: database file {DB_FILE} not found", file=sys.stderr)
+            return 1
+        if args.cmd == 'optimize':
+            print("Error: optimize is not supported by the embedded database (its hash index is covering already)", file=sys.stderr)
+            return 1
+        if getattr(args, 'jobs', 1) > 1 or getattr(args, 'rebuild_indexes', False):
+            print("Warning: options -j and -R are not supported by the embedded database; ignored", file=sys.stderr)
+            args.jobs = 1
+            args.rebuild_indexes = False
+
+    conn = db_connect()
 
     with conn:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
         if args.cmd == 'export' or args.cmd == 'list':
 
@@ -114,68 +1080,27 @@ def main():
                 args.overwrite = True
 
             # Fetch tracks
-            cur.execute("SELECT * FROM songs WHERE song_name LIKE %s ORDER BY song_name", (args.filter.translate({42: 37, 63: 95}),))
-            if cur.rowcount:
+            songs = db_songs(conn, args.filter)
+            if len(songs):
                 if args.cmd == 'list':
-                    for song in cur:
+                    for song in songs:
                         print(song['song_name'])
                 else:
-                    with alive_bar(cur.rowcount, title='Exporting', enrich_print=False) as bar:
-                        for song in cur:
-                            bar.text = song['song_name']
-                            if args.make_directories:
-                                fname = 'DB/' + '/'.join(song['song_name'].split('_')[:2])   # First two fields
-                                os.makedirs(fname, exist_ok=True)
-                                fname += '/' + song['song_name']
-                            else:
-                                fname = song['song_name']
-                            fname += "." + FORMAT
+                    n_unchanged = None
+                    if args.overwrite:
+                        songs, n_unchanged = export_plan(songs, args.make_directories, output_files)
+
+                    with alive_bar(len(songs), title='Exporting', enrich_print=False) as bar:
+                        for fname, messages in run_jobs(export_songs, [(job, args.make_directories, args.overwrite, args.overwrite_always, args.format_version, args.compression) for job in split_jobs(songs, args.jobs)], args.jobs, conn):
+                            bar.text = fname
+                            for message in messages:
+                                print(message)
                             if args.sync:
                                 output_files.add(fname)
-
-                            if os.path.exists(fname) and not args.overwrite_always:
-                                if args.overwrite:
-                                    with open(fname, newline='') as djv_file:
-                                        djv_reader = csv.reader(djv_file)
-                                        if not(file_check(song['song_name'], djv_reader)):
-                                            bar()
-                                            continue
-
-                                        song_file = next(djv_reader)
-                                        file_sha1 = song_file[2]
-                                        if file_sha1 == bytes(song['file_sha1']).hex():
-                                            print(f"{song['song_name']} (exists and checksum matches; skipped)")
-                                            bar()
-                                            continue
-                                else:
-                                    print(f"{song['song_name']} (exists; skipped)")
-                                    bar()
-                                    continue
-
-                            with open(fname, mode='w') as djv_file:
-                                djv_writer = csv.writer(djv_file)
-                                djv_writer.writerow([FORMAT, FORMAT_VERSION])
-                                djv_writer.writerow([song['song_name'], song['fingerprinted'], bytes(song['file_sha1']).hex(), song['total_hashes']])
-                                song_id = song['song_id']
-
-                                # Fetch fingerprints
-                                cur2 = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-                                cur2.execute("SELECT * FROM fingerprints WHERE song_id = %s ORDER BY fingerprints.offset, hash", (song_id,))
-                                for fingerprint in cur2:
-                                    djv_writer.writerow([fingerprint['offset'], bytes(fingerprint['hash']).hex()])
-                                cur2.close()
-                            print(f"{song['song_name']}: {fname}")
                             bar()
 
-                if args.cmd == 'export' and args.sync:
-                    files_on_disk = set()
-                    for root, dirs, files in os.walk('.'):
-                        for f in files:
-                            files_on_disk.add(os.path.join(root, f)[2:])
-                    extra_files = files_on_disk - output_files
-                    for f in extra_files:
-                        print(f"{f}: (does not exist in database; deleted on disk)")
-                        os.remove(f)
+                if args.cmd == 'export':
+                    export_sync(output_files, args.sync, n_unchanged)
 
             else:
                 print("No records found")
@@ -184,81 +1109,63 @@ def main():
             if args.sync:
                 args.overwrite = True
 
-            flist = []
-            for fname in args.filter:
-                if os.path.isdir(fname):
-                    for root, dirs, files in os.walk(fname):
-                        for f in files:
-                            flist.append(os.path.join(root, f))
-                else:
-                    flist.append(fname)
-
-            input_files = set()
-            with alive_bar(len(flist), title='Importing', enrich_print=False) as bar:
-                for f in flist:
-                    bar.text = f
-                    if os.path.exists(f):
-                        with open(f, newline='') as djv_file:
-                            djv_reader = csv.reader(djv_file)
-                            if not(file_check(f, djv_reader)):
-                                bar()
-                                continue
-
-                            song = next(djv_reader)
-                            song_name     = song[0]
-                            fingerprinted = song[1]
-                            file_sha1     = song[2]
-                            total_hashes  = song[3]
+            if DB_FILE == None:
+                cur = conn.cursor()
+                db_stats_init(cur)
+                conn.commit()
+            database_sha1 = {song['song_name']: bytes(song['file_sha1']).hex() for song in db_execute(conn, "SELECT song_name, file_sha1 FROM songs")}
+            conn.commit()
+            flist, input_files, n_unchanged = import_plan(args.filter, database_sha1, args.overwrite, args.overwrite_always)
+
+            n_imported = 0
+            n_fingerprints = 0
+            start_time = time.monotonic()
+
+            indexes = []
+            if args.rebuild_indexes and len(flist):
+                indexes = db_indexes(cur, 'fingerprints')
+                for index in indexes:
+                    cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(index[0])))
+                conn.commit()
+
+            try:
+                with alive_bar(len(flist), title='Importing', enrich_print=False) as bar:
+                    for song_name, n, messages in run_jobs(import_files, [(job, args.overwrite, args.overwrite_always) for job in split_jobs(flist, args.jobs)], args.jobs, conn):
+                        if song_name != None:
+                            bar.text = song_name
                             if args.sync:
                                 input_files.add(song_name)
-
-                            cur.execute("SELECT file_sha1 FROM songs WHERE song_name = %s", (song_name,))
-                            conn.commit()
-                            if cur.rowcount:
-                                song_db_sha1 = cur.fetchone()['file_sha1']
-                                if args.overwrite_always or args.overwrite and file_sha1 != bytes(song_db_sha1).hex():
-                                    cur.execute("DELETE FROM songs WHERE song_name = %s", (song_name,))
-                                else:
-                                    if args.overwrite:
-                                        print(f"{song_name} (exists and checksum matches; skipped)")
-                                    else:
-                                        print(f"{song_name} (exists; skipped)")
-                                    bar()
-                                    continue
-
-                            cur.execute("INSERT INTO songs (song_name, fingerprinted, file_sha1, total_hashes) VALUES (%s, %s, %s, %s) RETURNING song_id",
-                                (song_name, int(fingerprinted), bytes.fromhex(file_sha1), int(total_hashes)))
-                            song_id = int(cur.fetchone()[0])
-
-                            for fingerprint in djv_reader:
-                                offset = fingerprint[0]
-                                hash = fingerprint[1]
-
-                                cur.execute("INSERT INTO fingerprints (song_id, \"offset\", hash) VALUES (%s, %s, %s)",
-                                    (song_id, int(offset), bytes.fromhex(hash)))
-
-                            conn.commit()
-
-                        print(song_name)
-                    else:
-                        print(f"{f} (file not found)")
-                    bar()
-
+                        for message in messages:
+                            print(message)
+                        if n != None:
+                            n_imported += 1
+                            n_fingerprints += n
+                        bar()
+
+            finally:
+                if len(indexes):
+                    conn.rollback()
+                    index_time = time.monotonic()
+                    with alive_bar(title='Rebuilding indexes', receipt=False) as bar:
+                        for index in indexes:
+                            cur.execute(index[1])
+                        conn.commit()
+                    index_time = time.monotonic() - index_time
+
+            print_import_summary(len(flist), n_imported, n_fingerprints, n_unchanged, time.monotonic() - start_time)
+            if len(indexes):
+                print(f"Rebuilt {len(indexes)} indexes in {round(index_time, 1)} s")
+
+            n_deleted = 0
             if args.sync:
-                database_files = set()
-                cur.execute("SELECT song_name FROM songs")
-
-                for song in cur:
-                    database_files.add(song['song_name'])
-                extra_files = database_files - input_files
-
-                for f in extra_files:
-                    cur.execute("DELETE FROM songs WHERE song_name = %s", (f,))
-                    print(f"{f}: (does not exist on disk; deleted from the database)")
-
+                for song_name in sorted(set(database_sha1) - input_files):
+                    for song_name in db_delete_songs(conn, "song_name = %s", (song_name,)):
+                        print(f"{song_name}: (does not exist on disk; deleted from the database)")
+                        n_deleted += 1
                 conn.commit()
 
-            db_vacuum(conn)
+            if (n_imported or n_deleted) and not(args.no_vacuum):
+                db_maintain(conn)
 
         if args.cmd == 'rename':
             do_rename = True
@@ -270,64 +1177,14 @@ def main():
                 if args.name1.endswith('.' + FORMAT) or args.name2.endswith('.' + FORMAT):
 
                     # File system operation
-                    if os.path.exists(args.name1):
-                        if os.path.exists(args.name2) and not(args.overwrite_always):
-                            if args.overwrite:
-
-                                file1_sha1 = None
-                                file2_sha1 = None
-
-                                with open(args.name1, newline='') as djv_file:
-                                    djv_reader = csv.reader(djv_file)
-                                    if file_check(args.name1, djv_reader):
-                                        song_file = next(djv_reader)
-                                        file1_sha1 = song_file[2]
-
-                                with open(args.name2, newline='') as djv_file:
-                                    djv_reader = csv.reader(djv_file)
-                                    if file_check(args.name2, djv_reader):
-                                        song_file = next(djv_reader)
-                                        file2_sha1 = song_file[2]
-
-                                if file1_sha1 == file2_sha1:
-                                    print(" (target exists and checksum matches; skipped)")
-                                    do_rename = False
-                            else:
-                                print(" (target exists; skipped)")
-                                do_rename = False
-
-                        if do_rename:
-                            with open(args.name1, newline='') as djv_file1:
-                                djv_reader = csv.reader(djv_file1)
-                                if file_check(args.name1, djv_reader):
-                                    with open(args.name2, mode='w') as djv_file2:
-                                        djv_writer = csv.writer(djv_file2)
-                                        djv_writer.writerow([FORMAT, FORMAT_VERSION])
-                                        row = next(djv_reader)
-                                        row[0] = args.name2[:-len('.' + FORMAT)]
-                                        djv_writer.writerow(row)
-
-                                        for row in djv_reader:
-                                            djv_writer.writerow(row)
-                                        print(f": {args.name2}")
-                                else:
-                                    do_rename = False
-
-                            if do_rename:
-                                os.remove(args.name1)
-                    else:
-                        print(" (file not found)")
-                        do_rename = False
+                    do_rename = file_rename(args.name1, args.name2, args.overwrite, args.overwrite_always)
                 else:
 
                     # Database operation
-                    cur.execute("SELECT COUNT(*) FROM songs WHERE song_name = %s", (args.name1,))
-                    if int(cur.fetchone()[0]) > 0:
-                        cur.execute("SELECT COUNT(*) FROM songs WHERE song_name = %s", (args.name2,))
-                        if int(cur.fetchone()[0]) > 0:
+                    if int(db_execute(conn, "SELECT COUNT(*) FROM songs WHERE song_name = %s", (args.name1,)).fetchone()[0]) > 0:
+                        if int(db_execute(conn, "SELECT COUNT(*) FROM songs WHERE song_name = %s", (args.name2,)).fetchone()[0]) > 0:
                             if args.overwrite:
-                                cur.execute("SELECT COUNT(*) FROM songs WHERE song_name = %s AND file_sha1 IN (SELECT file_sha1 FROM songs WHERE song_name = %s)", (args.name2, args.name1))
-                                if int(cur.fetchone()[0]) > 0:
+                                if int(db_execute(conn, "SELECT COUNT(*) FROM songs WHERE song_name = %s AND file_sha1 IN (SELECT file_sha1 FROM songs WHERE song_name = %s)", (args.name2, args.name1)).fetchone()[0]) > 0:
                                     print(" (target exists and checksum matches; skipped)")
                                     do_rename = False
                             else:
@@ -335,16 +1192,19 @@ def main():
                                     print(" (target exists; skipped)")
                                     do_rename = False
                             if do_rename:
-                                cur.execute("DELETE FROM songs WHERE song_name = %s", (args.name2,))
+                                if DB_FILE == None:
+                                    db_stats_init(conn.cursor())
+                                db_delete_songs(conn, "song_name = %s", (args.name2,))
                         if do_rename:
-                            cur.execute("UPDATE songs SET song_name = %s WHERE song_name = %s RETURNING song_name", (args.name2, args.name1))
+                            cur = db_execute(conn, "UPDATE songs SET song_name = %s WHERE song_name = %s", (args.name2, args.name1))
                             conn.commit()
                             if cur.rowcount:
-                                print(f": {cur.fetchone()[0]}")
+                                print(f": {args.name2}")
                             else:
                                 print(" (not found)")
                                 do_rename = False
-                            db_vacuum(conn)
+                            if not(args.no_vacuum):
+                                db_maintain(conn)
                     else:
                         print(" (not found)")
                         do_rename = False
@@ -353,51 +1213,50 @@ def main():
 
         if args.cmd == 'delete':
             with alive_bar(title='Deleting', receipt=False) as bar:
-                cur.execute("DELETE FROM songs WHERE song_name LIKE %s RETURNING song_name", (args.filter.translate({42: 37, 63: 95}),))
+                if DB_FILE == None:
+                    db_stats_init(conn.cursor())
+                condition, pattern = db_name_match(args.filter)
+                songs = db_delete_songs(conn, condition, (pattern,))
                 conn.commit()
-            if cur.rowcount:
-                for song in cur:
-                    print(song['song_name'])
-                db_vacuum(conn)
+            if len(songs):
+                for song_name in songs:
+                    print(song_name)
+                if not(args.no_vacuum):
+                    db_maintain(conn)
             else:
                 print("No records found")
 
         if args.cmd == 'dbinfo':
-            print("Dejavu database info:")
+            info = db_info(conn, args.recompute)
+            n_ftracks = info['n_ftracks']
 
-            cur.execute("SELECT COUNT(song_id) AS n_tracks, COALESCE(SUM(fingerprinted), 0) AS n_ftracks FROM songs")
-            songs = cur.fetchone()
-            print(f"  Fingerprinted / total tracks = {songs['n_ftracks']} / {songs['n_tracks']}")
+            print("Dejavu database info:")
+            print(f"  Fingerprinted / total tracks = {n_ftracks} / {info['n_tracks']}")
 
-            cur.execute("SELECT COUNT(DISTINCT(song_id, \"offset\")) FROM fingerprints")
-            peak_groups = cur.fetchone()[0]
+            peak_groups = info['peak_groups']
             print(f"  Peak groups                  = {peak_groups}", end='')
-            if songs['n_ftracks'] != 0:
-                print(f" (avg. ~= {round(peak_groups / songs['n_ftracks'])} per track)")
+            if n_ftracks != 0:
+                print(f" (avg. ~= {round(peak_groups / n_ftracks)} per track)")
             else:
                 print()
 
-            cur.execute("SELECT COUNT(*) FROM fingerprints")
-            n_hashes = cur.fetchone()[0]
+            n_hashes = info['n_hashes']
             print(f"  Fingerprints                 = {n_hashes}", end='')
-            if songs['n_ftracks'] != 0:
-                print(f" (avg. ~= {round(n_hashes / songs['n_ftracks'])} per track)")
+            if n_ftracks != 0:
+                print(f" (avg. ~= {round(n_hashes / n_ftracks)} per track)")
             else:
                 print()
 
-            cur.execute("SELECT COALESCE(ROUND(SUM(max_offset) * %s * (1 - %s) / %s), 0) FROM (SELECT MAX(\"offset\") AS max_offset FROM fingerprints GROUP BY song_id) AS offsets", (DEFAULT_WINDOW_SIZE, DEFAULT_OVERLAP_RATIO, DEFAULT_FS))
-            times = cur.fetchone()[0]
+            times = info['times']
             print(f"  Total fingerprinted time    ~= {times} s", end='')
-            if songs['n_ftracks'] != 0:
-                print(f" (avg. ~= {round(times / songs['n_ftracks'], 1)} s per track)")
+            if n_ftracks != 0:
+                print(f" (avg. ~= {round(times / n_ftracks, 1)} s per track)")
             else:
                 print()
 
-            cur.execute("SELECT pg_database_size(%s) AS size, pg_size_pretty(pg_database_size(%s)) AS size_pretty", (DB_NAME, DB_NAME))
-            db_size = cur.fetchone()
-            print(f"  Database size               ~= {db_size['size_pretty']}", end='')
-            if songs['n_ftracks'] != 0:
-                print(f" (avg. ~= {round(db_size['size'] / 1024 / 1024 / songs['n_ftracks'], 2)} MB per track)")
+            print(f"  Database size               ~= {info['size_pretty']}", end='')
+            if n_ftracks != 0:
+                print(f" (avg. ~= {round(info['size'] / 1024 / 1024 / n_ftracks, 2)} MB per track)")
             else:
                 print()
 
@@ -406,11 +1265,9 @@ def main():
             else:
                 print("  Fingerprinting frequency     = n/a")
 
-            cur.execute("SELECT MIN(LENGTH(hash)), MAX(LENGTH(hash)) FROM fingerprints")
-            hashes = cur.fetchone()
-            if hashes['min'] != None and hashes['max'] != None:
-                min_size = int(hashes['min'])
-                max_size = int(hashes['max'])
+            if info['min'] != None and info['max'] != None:
+                min_size = int(info['min'])
+                max_size = int(info['max'])
                 if max_size != min_size:
                     print(f"  Hash size                    = {min_size}-{max_size} B")
                 else:
@@ -418,155 +1275,41 @@ def main():
             else:
                 print(f"  Hash size                    = n/a")
 
-            cur.execute("SELECT CASE WHEN COUNT(hash) <> 0 THEN ROUND((COUNT(hash) - COUNT(DISTINCT(hash))) * 100::NUMERIC / COUNT(hash), 2) ELSE 101 END FROM fingerprints")
-            col_rate = float(cur.fetchone()[0])
-            if col_rate <= 100:
-                print(f"  Hash collisions             ~= {col_rate}%")
+            collisions = info['collisions']
+            if collisions != None and collisions['n_hashes']:
+                print(f"  Hash collisions             ~= {round((collisions['n_hashes'] - collisions['n_distinct']) * 100 / collisions['n_hashes'], 2)}%", end='')
+                if collisions['n_hashes'] != n_hashes:
+                    print(f" (as of {collisions['date_computed']}; use -r to refresh)")
+                else:
+                    print()
             else:
-                print("  Hash collisions              = n/a")
-
-            cur.execute("SELECT date_trunc('second', LEAST(MIN(s.date_created), MIN(s.date_modified), MIN(f.date_created), MIN(f.date_modified))) FROM songs s, fingerprints f WHERE f.song_id = s.song_id")
-            date = cur.fetchone()[0]
-            print(f"  First update                ~= {date if date != None else 'n/a'}")
-            cur.execute("SELECT date_trunc('second', GREATEST(MAX(s.date_created), MAX(s.date_modified), MAX(f.date_created), MAX(f.date_modified))) FROM songs s, fingerprints f WHERE f.song_id = s.song_id")
-            date = cur.fetchone()[0]
-            print(f"  Last update                 ~= {date if date != None else 'n/a'}")
+                print("  Hash collisions              = n/a" + (" (use -r to compute)" if n_hashes else ""))
 
-            cur.execute("SELECT date_trunc('second', GREATEST(last_vacuum, last_autovacuum)::TIMESTAMP) FROM pg_stat_user_tables WHERE relname = 'fingerprints'")
-            print(f"  Last vacuum                 ~= {cur.fetchone()[0]}")
+            print(f"  First update                ~= {info['first_update'] if info['first_update'] != None else 'n/a'}")
+            print(f"  Last update                 ~= {info['last_update'] if info['last_update'] != None else 'n/a'}")
+            if DB_FILE == None:
+                print(f"  Last vacuum                 ~= {info['last_vacuum']}")
 
             ## AdVent-specific info
             if DB_USER == 'advent':
-                print("\nAdVent database info:")
-
-                cur.execute("SELECT COUNT(DISTINCT(split_part(song_name, '_', 1))) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                countries = cur.fetchone()[0]
-                print(f"  Countries                    = {countries}")
-
-                cur.execute("SELECT COUNT(DISTINCT(split_part(song_name, '_', 1) || '_' || split_part(song_name, '_', 2))) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                channels = cur.fetchone()[0]
-                print(f"  TV channels                  = {channels}", end="")
-                if countries != 0:
-                    print(f" (avg. ~= {round(channels / countries)} per country)")
-                else:
-                    print()
-
-                cur.execute("SELECT COALESCE(SUM(fingerprinted), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                jingles = cur.fetchone()[0]
-                print(f"  Jingles                      = {jingles}", end="")
-                if channels != 0:
-                    print(f" (avg. ~= {round(jingles / channels)} per TV channel)")
-                else:
-                    print()
-
-                cur.execute("SELECT COALESCE(SUM(CASE WHEN split_part(song_name, '_', 5) = '1' THEN 1 ELSE 0 END), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                pure_entry = cur.fetchone()[0]
-                cur.execute("SELECT COALESCE(SUM(split_part(song_name, '_', 5)::INTEGER & 1), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                print(f"  Pure entry / entry jingles   = {pure_entry} / {cur.fetchone()[0]}")
-
-                cur.execute("SELECT COALESCE(SUM(CASE WHEN split_part(song_name, '_', 5) = '2' THEN 1 ELSE 0 END), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                pure_exit = cur.fetchone()[0]
-                cur.execute("SELECT COALESCE(SUM(split_part(song_name, '_', 5)::INTEGER & 2 >> 1), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                print(f"  Pure exit / exit jingles     = {pure_exit} / {cur.fetchone()[0]}")
-
-                cur.execute("SELECT COALESCE(SUM(CASE WHEN split_part(song_name, '_', 5)::INTEGER & 3 = 0 THEN 1 ELSE 0 END), 0) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%'")
-                print(f"  No action jingles            = {cur.fetchone()[0]}")
-
-                cur.execute("WITH song_dates AS (SELECT MIN(split_part(song_name, '_', 3)) AS min_date FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%') SELECT '20' || substring(min_date FOR 2) || '-' || substring(min_date FROM 3 FOR 2) || '-' || substring(min_date FROM 5 FOR 2) FROM song_dates")
-                if cur.rowcount != 0:
-                    date = cur.fetchone()[0]
-                    print(f"  Time coverage from           = {date if date != None else 'n/a'}")
-                else:
-                    print(f"  Time coverage from           = n/a")
-
-                cur.execute("WITH song_dates AS (SELECT MAX(split_part(song_name, '_', 3)) AS min_date FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%') SELECT '20' || substring(min_date FOR 2) || '-' || substring(min_date FROM 3 FOR 2) || '-' || substring(min_date FROM 5 FOR 2) FROM song_dates")
-                if cur.rowcount != 0:
-                    date = cur.fetchone()[0]
-                    print(f"  Time coverage till           = {date if date != None else 'n/a'}")
-                else:
-                    print(f"  Time coverage till           = n/a")
+                advent_info(conn)
 
             # DB checks
             ## By convention, a query shall return 0 or false() if no problem detected
-            if args.check:
+            if args.check or args.check_all:
                 print("\nDatabase health checks:")
                 db_problem = False
 
-                res = db_check(cur,
-                    "SELECT COUNT(*) FROM songs s, fingerprints f WHERE f.song_id = s.song_id and GREATEST(s.date_created, s.date_modified, f.date_created, f.date_modified) > now()",
-                    "D0010: timestamps in future")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT count(*) FROM (SELECT date_created FROM songs WHERE date_created > date_modified UNION SELECT date_created FROM fingerprints WHERE date_created > date_modified) AS dates",
-                    "D0011: created > modified")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT COUNT(*) FROM songs s1, songs s2 WHERE s1.song_name = s2.song_name AND s1.file_sha1 <> s2.file_sha1",
-                    "D0020: same song name, different SHA1")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT COUNT(*) FROM songs s1, songs s2 WHERE s1.file_sha1 = s2.file_sha1 AND s1.song_name <> s2.song_name",
-                    "D0021: same SHA1, different song name")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT COUNT(*) FROM songs WHERE fingerprinted <> 0 AND total_hashes = 0",
-                    "D0030: fingerprinted without fingerprints")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT (SELECT SUM(total_hashes) FROM songs) <> (SELECT COUNT(*) FROM fingerprints)",
-                    "D0035: fingerprint counts mismatch")
-                db_problem = db_problem or res
-
-                res = db_check(cur,
-                    "SELECT (SELECT MIN(LENGTH(hash)) FROM fingerprints) <> (SELECT MAX(LENGTH(hash)) FROM fingerprints)",
-                    "D0040: fingerprint hashes of variable size")
-                db_problem = db_problem or res
-
-                # Need to take into account older Postgres
-                cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'pg_stat_user_tables' AND column_name = 'n_ins_since_vacuum'")
-                if cur.rowcount != 0:
-                    res = db_check(cur,
-                        "SELECT n_ins_since_vacuum + n_dead_tup FROM pg_stat_user_tables WHERE relname = 'fingerprints'",
-                        "D0100: vacuum needed")
-                else:
-                    res = db_check(cur,
-                        "SELECT n_dead_tup FROM pg_stat_user_tables WHERE relname = 'fingerprints'",
-                        "D0100: vacuum needed")
-                db_problem = db_problem or res
-
-                ## AdVent-specific checks
-                if DB_USER == 'advent':
-
-                    res = db_check(cur,
-                        "SELECT COUNT(*) FROM songs WHERE fingerprinted = 0",
-                        "A0010: non-fingerprinted tracks")
-                    db_problem = db_problem or res
-
-                    res = db_check(cur,
-                        "SELECT COUNT(*) FROM songs WHERE total_hashes < 500",
-                        "A0020: low confidence tracks")
-                    db_problem = db_problem or res
-
-                    res = db_check(cur,
-                        "SELECT COUNT(*) FROM songs WHERE LENGTH(song_name) - LENGTH(translate(song_name, '_', '')) <> 4",
-                        "A0050: bad track name format")
-                    db_problem = db_problem or res
-
-                    # Rudimentary check, because difficult to make it natively with Postgres
-                    res = db_check(cur,
-                        "SELECT COUNT(*) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%' AND split_part(song_name, '_', 3) !~ '^\d{2}(([0][1-9])|([1][0-2]))(([0-2][0-9])|([3][0-1]))$'",
-                        "A0051: bad track date format")
-                    db_problem = db_problem or res
-
-                    res = db_check(cur,
-                        "SELECT COUNT(*) FROM songs WHERE song_name LIKE '%\_%\_%\_%\_%' AND NOT(split_part(song_name, '_', 5)::INTEGER BETWEEN 0 AND 3)",
-                        "A0080: bad flags")
-                    db_problem = db_problem or res
+                # Results are shown in the order of the list
+                registry = SQLITE_CHECKS if DB_FILE != None else CHECKS
+                checks = [check for check in registry if (args.check_all or check[2] == CHECK_CHEAP) and (DB_USER == 'advent' or not check[3])]
+                for check, (res, status, error, duration) in zip(checks, db_checks(conn, checks, args.timeout)):
+                    print_check_result(check[0], res, duration=duration, status=status)
+                    if error != None:
+                        print(f"    {error}")
+                    db_problem = db_problem or bool(res)
+                if not(args.check_all):
+                    print(f"  ({len([check for check in registry if check[2] == CHECK_EXPENSIVE])} expensive checks skipped; use -C to run them)")
 
                 print("  ", end = '')
                 for i in range(TERM_WIDTH):
@@ -578,7 +1321,26 @@ def main():
         if args.cmd == 'vacuum':
             db_vacuum(conn, args.full)
 
-        cur.close()
+        if args.cmd == 'optimize':
+            cur = conn.cursor()
+            batches = db_bench_batches(cur)
+            conn.commit()
+            if len(batches):
+                print(f"Lookup benchmark: {len(batches)} lookups of up to {BENCH_BATCH} hashes")
+                before = db_bench(cur, batches)
+                conn.commit()
+                print_bench("before:", before)
+            if not(args.benchmark_only):
+                db_optimize(args.cluster)
+                if len(batches):
+                    after = db_bench(cur, batches)
+                    conn.commit()
+                    print_bench("after:", after)
+                    print(f"  Speedup ~= {before[0] / after[0]:.1f}x (p50), {before[1] / after[1]:.1f}x (p99)")
+            if not(len(batches)):
+                print("No fingerprints to benchmark")
+            cur.close()
+
         return RETURN_CODE
 
     return 1
@@ -14,13 +14,20 @@ setup(
     entry_points={
         "console_scripts": [
             "advent = advent.advent:main",
+            "advent-bench = advent.bench:main",
             "db-djv-pg = db_djv_pg.db_djv_pg:main"
         ]
     },
     install_requires=[
         'PyDejavu',
+        'numpy',
+        'PyAudio',
+        'pulsectl',
         'psycopg2',
         'requests',
         'alive-progress',
     ],
+    extras_require={
+        'zstd': ['zstandard'],
+    },
 )
@@ -0,0 +1,59 @@
+# .djv format: a track survives conversion between text (v1) and binary (v2) formats unchanged
+
+import hashlib
+import numpy as np
+import pytest
+
+pytest.importorskip("psycopg2")
+pytest.importorskip("alive_progress")
+from db_djv_pg.db_djv_pg import djv_read, djv_write
+
+N_FINGERPRINTS = 100
+HASH_SIZE = 10
+
+@pytest.fixture
+def jingle():
+    rng = np.random.default_rng(1)
+    track = {'song_name': 'fr_tf1_230101_1_1', 'fingerprinted': 1, 'file_sha1': hashlib.sha1(b'jingle').hexdigest(),
+        'total_hashes': N_FINGERPRINTS}
+    offsets = np.sort(rng.integers(0, 1000, N_FINGERPRINTS)).astype('<u4')
+    hashes = rng.integers(0, 256, (N_FINGERPRINTS, HASH_SIZE), dtype=np.uint8)
+    return track, offsets, hashes
+
+def assert_same(track, offsets, hashes, version, compression, read):
+    track2, offsets2, hashes2 = read
+    assert {key: track2[key] for key in track} == track
+    assert track2['version'] == version
+    assert track2['compression'] == compression
+    assert np.array_equal(offsets2, offsets)
+    assert np.array_equal(hashes2, hashes)
+
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_round_trip(tmp_path, jingle, compression):
+    track, offsets, hashes = jingle
+    v1 = tmp_path / 'track.v1.djv'
+    v2 = tmp_path / 'track.v2.djv'
+    v1_again = tmp_path / 'track.v1-again.djv'
+
+    djv_write(v1, track, offsets, hashes, version=1)
+    assert_same(track, offsets, hashes, 1, 'none', djv_read(v1, 1))
+
+    # v1 -> v2
+    djv_write(v2, *djv_read(v1, 1), version=2, compression=compression)
+    assert_same(track, offsets, hashes, 2, compression, djv_read(v2, 2))
+    assert djv_read(v2, 2, header_only=True)[0]['song_name'] == track['song_name']
+
+    # v2 -> v1
+    djv_write(v1_again, *djv_read(v2, 2), version=1)
+    assert v1_again.read_bytes() == v1.read_bytes()
+
+def test_variable_hash_size(tmp_path, jingle):
+    track, offsets, hashes = jingle
+    rows = [bytes(row[:HASH_SIZE - i % 2]) for i, row in enumerate(hashes)]
+    v1 = tmp_path / 'track.djv'
+
+    # Only text format can keep hashes of variable size
+    djv_write(v1, track, offsets, rows, version=1)
+    assert djv_read(v1, 1)[2] == rows
+    with pytest.raises(ValueError):
+        djv_write(tmp_path / 'track.v2.djv', track, offsets, rows, version=2)
@@ -0,0 +1,35 @@
+# Streaming fingerprinting: hashes produced portion by portion are the ones Dejavu computes over the same samples at once
+
+import numpy as np
+import pytest
+
+fingerprint = pytest.importorskip("dejavu.logic.fingerprint")
+from advent.StreamFingerprinter import StreamFingerprinter
+
+FS = 44100
+DURATION = 5                    # (s) - length of the synthetic stream
+
+@pytest.fixture(scope='module')
+def samples():
+    rng = np.random.default_rng(1)
+    t = np.arange(DURATION * FS) / FS
+    tones = sum(np.sin(2 * np.pi * freq * t) * (t % 1 < duty) for freq, duty in ((440, 0.3), (1250, 0.6), (3100, 0.8)))
+    return (4000 * tones + rng.normal(0, 500, len(t))).astype(np.int16)
+
+# Same as advent: consecutive portions overlap, the next one starting n_columns * HOP samples later
+@pytest.mark.parametrize('n_columns', [2, 43, 200])
+def test_same_hashes_as_dejavu(samples, n_columns):
+    fingerprinter = StreamFingerprinter(FS)
+    hashes = []
+    start = 0
+    length = StreamFingerprinter.getPortionLength(n_columns)
+    while start + length <= len(samples):
+        hashes.extend(fingerprinter.process(samples[start:start + length]))
+        start += n_columns * StreamFingerprinter.HOP
+    assert len(hashes)
+
+    # Both go through peaks in the same order; only peaks still queued are not hashed yet
+    expected = fingerprint.fingerprint(samples[:start - n_columns * StreamFingerprinter.HOP + length], Fs=FS)
+    assert hashes == expected[:len(hashes)]
+    if len(expected) > len(hashes):
+        assert all(offset >= fingerprinter.peaks[0][1] for hsh, offset in expected[len(hashes):])
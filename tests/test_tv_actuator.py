@@ -0,0 +1,79 @@
+# Asynchronous TV control: a command undoing a queued one removes both, while commands already sent reach the TV
+
+import threading
+from tv_control.TVControl import TVControl
+from tv_control.TVActuator import TVActuator
+
+TIMEOUT = 5                     # (s) - wait limit for the worker thread
+
+# TV recording commands received; the first one can be held to keep the worker busy
+class FakeTV(TVControl):
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.received = threading.Semaphore(0)
+        self.release = threading.Event()
+        self.release.set()
+
+    def toggleMute(self):
+        self.calls.append('toggleMute')
+        self.received.release()
+        self.release.wait(TIMEOUT)
+        return super().toggleMute()
+
+    def lowerVolume(self, new_volume = '50%'):
+        self.calls.append('lowerVolume')
+        self.received.release()
+        return super().lowerVolume(new_volume)
+
+    def restoreVolume(self):
+        self.calls.append('restoreVolume')
+        self.received.release()
+        return super().restoreVolume()
+
+def test_inverse_commands_cancel():
+    tv = TVActuator(FakeTV())
+
+    # Worker not started, so everything stays queued
+    tv.toggleMute()
+    assert tv.isMuted()
+    tv.toggleMute()
+    assert not tv.isMuted()
+    assert len(tv.commands) == 0
+
+    tv.lowerVolume()
+    assert tv.lowVolume()
+    tv.restoreVolume()
+    assert not tv.lowVolume()
+    assert len(tv.commands) == 0
+
+    # Nested pairs cancel as well
+    tv.toggleMute()
+    tv.lowerVolume()
+    tv.restoreVolume()
+    tv.toggleMute()
+    assert len(tv.commands) == 0
+    assert tv.tvc.calls == []
+
+def test_other_commands_stay_queued():
+    tv = TVActuator(FakeTV())
+    tv.toggleMute()
+    tv.lowerVolume()
+    tv.toggleMute()
+    assert [command for command, args in tv.commands] == ['toggleMute', 'lowerVolume', 'toggleMute']
+
+def test_sent_command_not_cancelled():
+    tvc = FakeTV()
+    tvc.release.clear()
+    tv = TVActuator(tvc)
+    tv.start()
+
+    # First mute is being executed when unmute comes, so both must reach the TV
+    tv.toggleMute()
+    assert tvc.received.acquire(timeout=TIMEOUT)
+    tv.toggleMute()
+    assert not tv.isMuted()
+    tvc.release.set()
+    assert tvc.received.acquire(timeout=TIMEOUT)
+    assert tvc.calls == ['toggleMute', 'toggleMute']
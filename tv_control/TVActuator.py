@@ -0,0 +1,91 @@
+# TV interface (asynchronous)
+## Drives another TV control from a worker thread, so that recognition never waits for the TV. Commands are queued, and
+## the state reported is the state the TV will reach (or the real state when nothing is pending). A command undoing a
+## queued one (e.g., unmute after a mute not yet sent) removes both from the queue
+
+from tv_control.TVControl import TVControl
+from collections import deque
+import threading
+import time
+
+class TVActuator(TVControl):
+
+    # Pairs of commands cancelling each other
+    INVERSE = [('toggleMute', 'toggleMute'), ('lowerVolume', 'restoreVolume')]
+
+    def __init__(self, tvc):
+        super().__init__()
+        self.tvc = tvc
+        self.muted = tvc.isMuted()
+        self.lowered = tvc.lowVolume()
+        self.commands = deque()    # (method, arguments) not sent yet
+        self.busy = False          # a command is being executed
+        self.cond = threading.Condition()
+        self.on_result = None      # called from the worker thread with command, success and duration (s) of every command sent
+        tvc.on_change = self.onChange
+        self.worker = threading.Thread(target=self.run, name='TVActuator', daemon=True)
+
+    def start(self):
+        self.tvc.start()
+        self.worker.start()
+
+    # TV might also be controlled by other means
+    def isMuted(self):
+        with self.cond:
+            if not self.busy and not len(self.commands):
+                self.muted = self.tvc.isMuted()
+            return self.muted
+
+    def lowVolume(self):
+        return self.lowered
+
+    # Pending commands still define the state the TV will reach, so only forward the change
+    def onChange(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def toggleMute(self):
+        with self.cond:
+            self.muted = not self.isMuted()
+            self.submit('toggleMute')
+        return True
+
+    def lowerVolume(self, *args):
+        with self.cond:
+            self.submit('lowerVolume', *args)
+            self.lowered = True
+        return True
+
+    def restoreVolume(self):
+        with self.cond:
+            self.submit('restoreVolume')
+            self.lowered = False
+        return True
+
+    # Must be called with condition locked
+    def submit(self, command, *args):
+        if len(self.commands) and (self.commands[-1][0], command) in self.INVERSE:
+            self.commands.pop()
+        else:
+            self.commands.append((command, args))
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: len(self.commands))
+                command, args = self.commands.popleft()
+                self.busy = True
+            start_time = time.monotonic()
+            ok = getattr(self.tvc, command)(*args)
+            duration = time.monotonic() - start_time
+            with self.cond:
+                self.busy = False
+                if not ok:
+
+                    # Queued commands assumed this one succeeded; drop them and fall back to the real TV state
+                    self.commands.clear()
+                    self.muted = self.tvc.isMuted()
+                    self.lowered = self.tvc.lowVolume()
+            if self.on_result is not None:
+                self.on_result(command, ok, duration)
@@ -5,6 +5,11 @@ class TVControl:
         self.muted = False
         self.nominal_volume = "100%"
         self.current_volume = "50%"
+        self.on_change = None      # called when the TV state is changed by other means than AdVent, if the control can tell
+
+    # Start background activity, if any. Called once, after AdVent has started its worker processes
+    def start(self):
+        pass
 
     # This method can be called as frequently as once per second, so do not override it with something querying network or real hardware
     # This should have been marked "final" but Python 3.7 does not support it yet
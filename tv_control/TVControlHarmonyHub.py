@@ -12,10 +12,11 @@ class TVControlHarmonyHub(TVControl):
         self.current_volume = self.nominal_volume
         self.api_server = "http://localhost:8282/hubs/harmony/commands/"
         self.command_data = {'on': 'on'}
+        self.session = requests.Session()    # keeps connection to the API server alive between commands
 
     def toggleMute(self):
         try:
-            requests.post(self.api_server + "mute", data = self.command_data)
+            self.session.post(self.api_server + "mute", data = self.command_data)
             return super().toggleMute()
         except requests.exceptions.RequestException as e:
             print(e)
@@ -31,7 +32,7 @@ class TVControlHarmonyHub(TVControl):
         command = "volume-down" if vol < 0 else "volume-up"
         try:
             for i in range(vol if vol >= 0 else -vol):
-                requests.post(self.api_server + command, data = self.command_data)
+                self.session.post(self.api_server + command, data = self.command_data)
                 time.sleep(0.25)
             return super().lowerVolume(new_volume)
         except requests.exceptions.RequestException as e:
@@ -43,7 +44,7 @@ class TVControlHarmonyHub(TVControl):
         command = "volume-down" if vol < 0 else "volume-up"
         try:
             for i in range(vol if vol >= 0 else -vol):
-                requests.post(self.api_server + command, data = self.command_data)
+                self.session.post(self.api_server + command, data = self.command_data)
                 time.sleep(0.25)
             return super().restoreVolume()
         except requests.exceptions.RequestException as e:
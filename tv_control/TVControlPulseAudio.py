@@ -1,26 +1,100 @@
 # TV interface (PulseAudio)
-## TODO: switch to Python API?
+## Talks to the sound server (PulseAudio or PipeWire) over its native protocol, keeping the connection open. A second
+## connection listens to sink events, so that mute state stays right when the sound is muted by other means
 
 from tv_control.TVControl import TVControl
-import os
-import subprocess
+import math
+import threading
+import pulsectl
 
 class TVControlPulseAudio(TVControl):
 
+    VOLUME_NORM = 0x10000    # PulseAudio volume of 100%
+
     def __init__(self):
         super().__init__()
-        self.muted = subprocess.run(['pactl', 'get-sink-mute', '@DEFAULT_SINK@'], stdout=subprocess.PIPE).stdout.decode('utf-8') == "Mute: yes\n"
-        self.nominal_volume = subprocess.run(['pactl', 'get-sink-volume', '@DEFAULT_SINK@'], stdout=subprocess.PIPE).stdout.decode('utf-8').split('/')[1].strip()
+        self.pulse = pulsectl.Pulse('advent')
+        self.pulse_lock = threading.Lock()
+        sink = self.pulse.sink_default_get()
+        self.muted = bool(sink.mute)
+        self.nominal_volume = f'{round(sink.volume.value_flat * 100)}%'
         self.current_volume = "0%" if self.muted else self.nominal_volume
+        self.listener = threading.Thread(target=self.listen, name='PulseAudio', daemon=True)
+
+    def start(self):
+        self.listener.start()
+
+    # Volume specification as in pactl: integer, linear factor, percentage or decibels; relative if signed
+    def parseVolume(self, volume, current):
+        relative = volume[:1] in ('+', '-')
+        if volume.endswith('%'):
+            value = float(volume[:-1]) / 100
+            return max(0, current + value if relative else value)
+        if volume.lower().endswith('db'):
+            db = float(volume[:-2])
+            if relative:
+                if current == 0:
+                    return 0
+                db += 20 * math.log10(current ** 3)
+            return (10 ** (db / 20)) ** (1 / 3)    # PulseAudio software volume is cubic
+        if '.' in volume:
+            value = float(volume) ** (1 / 3) if not relative else float(volume)
+        else:
+            value = int(volume) / self.VOLUME_NORM
+        return max(0, current + value if relative else value)
+
+    def setVolume(self, volume):
+        with self.pulse_lock:
+            sink = self.pulse.sink_default_get()
+            self.pulse.volume_set_all_chans(sink, self.parseVolume(volume, sink.volume.value_flat))
 
     def toggleMute(self):
-        ret = os.system("pactl set-sink-mute @DEFAULT_SINK@ toggle")
-        return os.WIFEXITED(ret) and os.WEXITSTATUS(ret) == 0 and super().toggleMute()
+        try:
+            with self.pulse_lock:
+                sink = self.pulse.sink_default_get()
+                self.pulse.mute(sink, not sink.mute)
+                self.muted = bool(sink.mute)
+            return True
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            print(e)
+        return False
 
     def lowerVolume(self, new_volume = '50%'):
-        ret = os.system("pactl set-sink-volume @DEFAULT_SINK@ " + new_volume)
-        return os.WIFEXITED(ret) and os.WEXITSTATUS(ret) == 0 and super().lowerVolume(new_volume)
+        try:
+            self.setVolume(new_volume)
+            return super().lowerVolume(new_volume)
+        except ValueError:
+            print(f"Invalid volume parameter \'{new_volume}\' for 'lower_volume'")
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            print(e)
+        return False
 
     def restoreVolume(self):
-        ret = os.system("pactl set-sink-volume @DEFAULT_SINK@ " + self.nominal_volume)
-        return os.WIFEXITED(ret) and os.WEXITSTATUS(ret) == 0 and super().restoreVolume()
+        try:
+            self.setVolume(self.nominal_volume)
+            return super().restoreVolume()
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            print(e)
+        return False
+
+    # Requests cannot be sent from an event callback, so the callback only stops the event loop, and the state is queried after.
+    # AdVent's own mute toggles are already accounted for; any other change is reported
+    def listen(self):
+        try:
+            with pulsectl.Pulse('advent-events') as pulse:
+                pulse.event_mask_set('sink', 'server')
+                pulse.event_callback_set(self.onEvent)
+                while True:
+                    pulse.event_listen()
+                    muted = bool(pulse.sink_default_get().mute)
+                    with self.pulse_lock:
+                        changed = muted != self.muted
+                        self.muted = muted
+                    if changed and self.on_change is not None:
+                        self.on_change()
+        except (pulsectl.PulseError, pulsectl.PulseDisconnected) as e:
+            print(e)
+
+    def onEvent(self, event):
+        if event.t == 'change':
+            raise pulsectl.PulseLoopStop